@@ -0,0 +1,175 @@
+import argparse
+import chess
+import multiprocessing
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from board import decode_move
+from engine import Engine
+from tt import EXACT, LOWER, UPPER
+
+# PARALLEL ANALYSIS
+# fixed depth analysis of a single position, with the root moves split between processes: at each depth, the
+# first root move (the best of the previous depth) is searched serially with a full window, which gives a bound
+# for the rest - and the rest are then handed to a pool of worker engines, each with its own board and caches,
+# which search them with a null window on that bound (as in pvs), and again with a full window above it if they
+# beat it. the bound is shared: a worker whose move beats it raises it for the moves that are searched later.
+#
+# unlike lazy smp (see smp.py) every root move is searched to exactly the given depth. the result isn't
+# reproducible though: whether a move gets an exact score or just a bound depends on the bound when it's searched,
+# which depends on which workers finished first - as do the entries in each worker's transposition table, which
+# may change a score slightly. so with moves that are (nearly) tied, the best move can differ from run to run, and
+# from a serial search.
+
+# the shared bound, and the engine of a worker process
+_alpha = None
+_engine = None
+_root = None
+_depth = None
+
+def _init_worker(alpha):
+    global _alpha, _engine
+    _alpha = alpha
+    _engine = Engine()
+    _engine.BOOK = False
+    # analysis is by depth only
+    _engine.move_time_limit = float('inf')
+
+def _search_move(fen, moves, move, depth, alpha):
+    """ (move, value, bound, nodes) - the value is exact, or only a lower or upper bound (as in the tt) """
+    global _root, _depth
+    e = _engine
+    board = chess.Board(fen)
+    for m in moves:
+        board.push_uci(m)
+    if (fen, moves) != _root:
+        # a new position - its caches are of no use
+        e._init_game_state(board)
+        _root = (fen, moves)
+        _depth = None
+    else:
+        e.board.set_board(board)
+    if depth != _depth:
+        e._new_iteration()
+        e.tt.new_search()
+        _depth = depth
+    e._start_clock()
+    e._check_endgame()
+    prev_nodes = e.nodes
+    alpha = max(alpha, _alpha.value)
+    piece_from, piece_to = e._make_move(move)
+    value = -e._negamax(depth - 1, 0, -alpha - 1, -alpha)
+    bound = UPPER
+    if value > alpha:
+        # at least as good as the value found by the null window - unless the bound has gone up while this move
+        # was searched, it's searched again for its exact value
+        bound = LOWER
+        alpha = max(alpha, _alpha.value)
+        if value > alpha:
+            value = -e._negamax(depth - 1, 0, -Engine.INF, -alpha)
+            bound = EXACT if value > alpha else UPPER
+    e._unmake_move(move, piece_from, piece_to)
+    if bound == EXACT:
+        with _alpha.get_lock():
+            if value > _alpha.value:
+                _alpha.value = value
+    return move, value, bound, e.nodes - prev_nodes
+
+class ParallelAnalysis(object):
+
+    # shallower depths are searched serially - they take less time than handing out the moves
+    MIN_SPLIT_DEPTH = 3
+
+    def __init__(self, workers):
+        self.engine = Engine()
+        self.engine.BOOK = False
+        self.engine.move_time_limit = float('inf')
+        self.alpha = multiprocessing.Value('i', -Engine.INF)
+        self.pool = ProcessPoolExecutor(workers, initializer = _init_worker, initargs = (self.alpha,))
+        self.nodes = 0
+
+    def analyze(self, board, depth):
+        """ (best move, value, {move: (value, bound)}) of the chess.Board, searched to the given depth - the moves
+            other than the best may have only a bound (LOWER or UPPER) rather than an EXACT value """
+        e = self.engine
+        e._init_game_state(board)
+        e._start_clock()
+        e.tt.new_search()
+        e._check_endgame()
+        e.root_scores = {}
+        self.nodes = 0
+        if not any(e.board.legal_moves):
+            # checkmate or stalemate, scored as in search
+            return None, -Engine.MATE_SCORE if e.board.is_check() else 0, {}
+        root = (board.root().fen(), [move.uci() for move in board.move_stack])
+        for d in range(1, depth + 1):
+            if d < self.MIN_SPLIT_DEPTH and d < depth:
+                e._search_root(d)
+            else:
+                best_move, value, move_values = self._split_root(root, d)
+        self.nodes += e.nodes
+        return decode_move(best_move), value, {decode_move(move): v for move, v in move_values.items()}
+
+    def _split_root(self, root, depth):
+        e = self.engine
+        e._new_iteration()
+        moves = e._root_moves()
+        first = moves[0]
+        piece_from, piece_to = e._make_move(first)
+        value = -e._negamax(depth - 1, 0, -Engine.INF, Engine.INF)
+        e._unmake_move(first, piece_from, piece_to)
+        move_values = {first: (value, EXACT)}
+        # moves that raised the bound, which (as in _search_root) order the next depth's moves
+        scores = {first: value}
+        self.alpha.value = value
+        fen, root_moves = root
+        futures = [self.pool.submit(_search_move, fen, root_moves, move, depth, value) for move in moves[1:]]
+        for future in as_completed(futures):
+            move, value, bound, nodes = future.result()
+            move_values[move] = (value, bound)
+            if bound == EXACT:
+                scores[move] = value
+            self.nodes += nodes
+        # ties between exact scores go to the earlier move in the root order
+        best_move = max((move for move in moves if move in scores), key = lambda move: scores[move])
+        e.root_scores = scores
+        return best_move, scores[best_move], move_values
+
+    def close(self):
+        self.pool.shutdown()
+
+def get_args():
+    parser = argparse.ArgumentParser(description='fixed depth analysis of a position, split between processes')
+    parser.add_argument('--fen', default=chess.STARTING_FEN)
+    parser.add_argument('--depth', type=int, required=True)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--serial', action='store_true', help='also search serially, for comparison')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+    board = chess.Board(args.fen)
+    analysis = ParallelAnalysis(args.workers)
+    t0 = time.time()
+    move, value, move_values = analysis.analyze(board, args.depth)
+    t = time.time() - t0
+    analysis.close()
+    if move is None:
+        print('%s: %.2f' % ('checkmate' if board.is_check() else 'stalemate', value / 100))
+        sys.exit()
+    for m, (v, bound) in sorted(move_values.items(), key = lambda item: -item[1][0]):
+        print('%s: %s%.2f' % (board.san(m), {EXACT: '', LOWER: '>= ', UPPER: '<= '}[bound], v / 100))
+    print('best: %s %.2f (depth %d, %d workers) - %d nodes, %.2fs' % (
+            board.san(move), value / 100, args.depth, args.workers, analysis.nodes, t))
+    if args.serial:
+        e = Engine()
+        e.BOOK = False
+        e.MAX_ITER_DEPTH = args.depth
+        e.move_time_limit = float('inf')
+        e.set_fen(args.fen)
+        t0 = time.time()
+        move = e._select_move()
+        print('serial: %s %.2f - %d nodes, %.2fs' % (board.san(move), e.move_evals[-1][1] / 100, e.nodes,
+                                                     time.time() - t0))
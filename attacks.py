@@ -0,0 +1,92 @@
+import chess
+import os
+import pickle
+
+# SLIDER ATTACK TABLES
+# python-chess keeps separate rank and file attack tables, so every rook (or queen) lookup is two
+# table lookups. here rook attacks have a single table per square, keyed by the occupancy of the
+# relevant rank and file squares (i.e. excluding the board edges):
+#
+#   rook attacks:   BB_ROOK_ATTACKS[square][BB_ROOK_MASKS[square] & occupied]
+#   bishop attacks: BB_BISHOP_ATTACKS[square][BB_BISHOP_MASKS[square] & occupied]
+#
+# NOTE: magic bitboard indexing into flat lists was tried as well, but in python the 64 bit
+#       multiplication (which allocates a 128 bit int) is slower than just hashing the masked
+#       occupancy - see bench.py attacks.
+#
+# building the tables takes about half a second, so they are cached on disk.
+
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'attacks.pkl')
+CACHE_VERSION = 1
+
+ROOK_DELTAS = (-8, -1, 1, 8)
+BISHOP_DELTAS = (-9, -7, 7, 9)
+
+def _sliding_attacks(square, occupied, deltas):
+    attacks = 0
+    for delta in deltas:
+        sq = square
+        while True:
+            sq += delta
+            # stop when going off the board or wrapping around a file edge
+            if not (0 <= sq < 64) or abs(chess.square_file(sq) - chess.square_file(sq - delta)) > 1:
+                break
+            attacks |= chess.BB_SQUARES[sq]
+            if occupied & chess.BB_SQUARES[sq]:
+                break
+    return attacks
+
+def _edges(square):
+    return (((chess.BB_RANK_1 | chess.BB_RANK_8) & ~chess.BB_RANKS[chess.square_rank(square)]) |
+            ((chess.BB_FILE_A | chess.BB_FILE_H) & ~chess.BB_FILES[chess.square_file(square)]))
+
+def _subsets(mask):
+    # all subsets of the mask, using the carry-rippler trick
+    subset = 0
+    while True:
+        yield subset
+        subset = (subset - mask) & mask
+        if not subset:
+            break
+
+def _build_table(deltas):
+    masks = []
+    attacks = []
+    for square in chess.SQUARES:
+        mask = _sliding_attacks(square, 0, deltas) & ~_edges(square)
+        masks.append(mask)
+        attacks.append({occupied: _sliding_attacks(square, occupied, deltas) for occupied in _subsets(mask)})
+    return masks, attacks
+
+def build_tables():
+    return _build_table(ROOK_DELTAS) + _build_table(BISHOP_DELTAS)
+
+def _load_tables():
+    try:
+        with open(CACHE_FILE, 'rb') as f:
+            version, tables = pickle.load(f)
+        if version == CACHE_VERSION:
+            return tables
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        pass
+    tables = build_tables()
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        with open(CACHE_FILE, 'wb') as f:
+            pickle.dump((CACHE_VERSION, tables), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        # not being able to write the cache is fine, we'll just build the tables next time as well
+        pass
+    return tables
+
+BB_ROOK_MASKS, BB_ROOK_ATTACKS, BB_BISHOP_MASKS, BB_BISHOP_ATTACKS = _load_tables()
+
+def rook_attacks(square, occupied):
+    return BB_ROOK_ATTACKS[square][BB_ROOK_MASKS[square] & occupied]
+
+def bishop_attacks(square, occupied):
+    return BB_BISHOP_ATTACKS[square][BB_BISHOP_MASKS[square] & occupied]
+
+def queen_attacks(square, occupied):
+    return (BB_ROOK_ATTACKS[square][BB_ROOK_MASKS[square] & occupied] |
+            BB_BISHOP_ATTACKS[square][BB_BISHOP_MASKS[square] & occupied])
@@ -0,0 +1,299 @@
+import chess
+import numpy as np
+
+from eval import (PIECE_VALUES, PIECE_SQUARE_VALUES, PHASE_WEIGHTS, MAX_PHASE, PAWN_STOPPERS, ADJACENT_FILES,
+                  PAWN_SUPPORT_MASKS, KING_SHELTER_SQUARES, PAWN_SHIELD_MASKS, DOUBLED_PAWN_SCORE, ISOLATED_PAWN_SCORE,
+                  BACKWARD_PAWN_SCORE, BISHOP_PAIR_SCORE, MOBILITY_SCORE, KING_ZONE_ATTACK_SCORE, mg_value, eg_value)
+import square_tables
+
+# BATCHED POSITIONS
+# N positions as uint64 numpy arrays, for bulk offline work (pgn analysis, tuning, batch scoring) where
+# handling one board at a time is too slow. everything here is vectorized over the whole batch.
+#
+# bitboards are in a (2, 7, N) array indexed by [color][piece type], with piece type 0 holding all pieces
+# of that color (i.e. occupied_co) - so e.g. white knights are pieces[WHITE][KNIGHT].
+#
+# NOTE: numpy is only needed for this module (and what uses it), not by the engine.
+
+# ints rather than bools, as numpy treats a bool index as a mask
+WHITE = int(chess.WHITE)
+BLACK = int(chess.BLACK)
+COLORS = [WHITE, BLACK]
+
+PAWN = chess.PAWN
+KNIGHT = chess.KNIGHT
+BISHOP = chess.BISHOP
+ROOK = chess.ROOK
+QUEEN = chess.QUEEN
+KING = chess.KING
+PIECE_TYPES = chess.PIECE_TYPES
+
+U64 = np.uint64
+BB_ALL = U64(chess.BB_ALL)
+BB_NOT_A = U64(chess.BB_ALL & ~chess.BB_FILE_A)
+BB_NOT_H = U64(chess.BB_ALL & ~chess.BB_FILE_H)
+BB_NOT_AB = U64(chess.BB_ALL & ~chess.BB_FILE_A & ~chess.BB_FILE_B)
+BB_NOT_GH = U64(chess.BB_ALL & ~chess.BB_FILE_G & ~chess.BB_FILE_H)
+
+# (shift, mask of squares that can be reached without wrapping around a file edge) - positive is left
+ROOK_DIRECTIONS = [(8, BB_ALL), (-8, BB_ALL), (1, BB_NOT_A), (-1, BB_NOT_H)]
+BISHOP_DIRECTIONS = [(9, BB_NOT_A), (7, BB_NOT_H), (-7, BB_NOT_A), (-9, BB_NOT_H)]
+KING_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KNIGHT_DIRECTIONS = [(17, BB_NOT_A), (15, BB_NOT_H), (10, BB_NOT_AB), (6, BB_NOT_GH),
+                     (-6, BB_NOT_AB), (-10, BB_NOT_GH), (-15, BB_NOT_A), (-17, BB_NOT_H)]
+PAWN_DIRECTIONS = [[(-7, BB_NOT_A), (-9, BB_NOT_H)], [(9, BB_NOT_A), (7, BB_NOT_H)]] # by color
+
+def _shift(x, shift):
+    return x << U64(shift) if shift > 0 else x >> U64(-shift)
+
+def _step_attacks(pieces, directions):
+    attacks = np.zeros_like(pieces)
+    for shift, mask in directions:
+        attacks |= _shift(pieces, shift) & mask
+    return attacks
+
+def _slider_fill(sliders, empty, shift, mask):
+    # kogge-stone occluded fill in a single direction
+    gen = sliders
+    pro = empty & mask
+    for s in (shift, 2 * shift, 4 * shift):
+        gen = gen | (pro & _shift(gen, s))
+        pro = pro & _shift(pro, s)
+    return _shift(gen, shift) & mask
+
+def _slider_attacks(sliders, empty, directions):
+    attacks = np.zeros_like(sliders)
+    for shift, mask in directions:
+        attacks |= _slider_fill(sliders, empty, shift, mask)
+    return attacks
+
+def popcount(x):
+    """ vectorized popcount of a uint64 array """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x).astype(np.int32)
+    x = x - ((x >> U64(1)) & U64(0x5555555555555555))
+    x = (x & U64(0x3333333333333333)) + ((x >> U64(2)) & U64(0x3333333333333333))
+    x = (x + (x >> U64(4))) & U64(0x0F0F0F0F0F0F0F0F)
+    return ((x * U64(0x0101010101010101)) >> U64(56)).astype(np.int32)
+
+def square_bits(x):
+    """ unpacks a uint64 array into an (N, 64) array of 0/1 by square """
+    return np.unpackbits(x.astype('<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+
+def _pst(name):
+    # (2, 64) array by [color][square] from the square tables
+    return np.array(getattr(square_tables, name), dtype=np.int32)
+
+PIECE_NAMES = [None, 'PAWN', 'KNIGHT', 'BISHOP', 'ROOK', 'QUEEN', 'KING']
+MG_PST = [None] + [_pst('MG_%s_SQ_TABLE' % PIECE_NAMES[piece_type]) for piece_type in PIECE_TYPES]
+EG_PST = [None] + [_pst('EG_%s_SQ_TABLE' % PIECE_NAMES[piece_type]) for piece_type in PIECE_TYPES]
+
+class PositionBatch(object):
+
+    def __init__(self, n):
+        self.pieces = np.zeros((2, 7, n), dtype=np.uint64)
+        self.turn = np.zeros(n, dtype=bool)
+        self.castling_rights = np.zeros(n, dtype=np.uint64)
+        self.ep_square = np.full(n, -1, dtype=np.int8) # -1 if none
+
+    @classmethod
+    def from_boards(cls, boards):
+        """ from chess.Board, Board or SearchBoard objects """
+        boards = list(boards)
+        batch = cls(len(boards))
+        for color in COLORS:
+            batch.pieces[color][0] = [board.occupied_co[color] for board in boards]
+            for piece_type in PIECE_TYPES:
+                batch.pieces[color][piece_type] = [_pieces_mask(board, piece_type, color) for board in boards]
+        batch.turn[:] = [board.turn for board in boards]
+        batch.castling_rights[:] = [board.castling_rights for board in boards]
+        batch.ep_square[:] = [-1 if board.ep_square is None else board.ep_square for board in boards]
+        return batch
+
+    @classmethod
+    def from_fens(cls, fens):
+        return cls.from_boards(chess.Board(fen) for fen in fens)
+
+    def __len__(self):
+        return self.pieces.shape[2]
+
+    def board(self, i):
+        """ returns position i as a chess.Board (for checking/debugging) """
+        board = chess.Board(None)
+        for color in COLORS:
+            for piece_type in PIECE_TYPES:
+                for sq in chess.scan_forward(int(self.pieces[color][piece_type][i])):
+                    board.set_piece_at(sq, chess.Piece(piece_type, bool(color)))
+        board.turn = bool(self.turn[i])
+        board.castling_rights = int(self.castling_rights[i])
+        board.ep_square = None if self.ep_square[i] < 0 else int(self.ep_square[i])
+        return board
+
+    @property
+    def occupied(self):
+        return self.pieces[WHITE][0] | self.pieces[BLACK][0]
+
+    def attacks(self, color, piece_type = None):
+        """ squares attacked by the given color (or only by the given piece type of it) """
+        color = int(color)
+        pieces = self.pieces[color]
+        attacks = np.zeros(len(self), dtype=np.uint64)
+        # queens are filled together with bishops and rooks
+        diagonal = np.zeros_like(attacks)
+        straight = np.zeros_like(attacks)
+        for pt in (PIECE_TYPES if piece_type is None else [piece_type]):
+            if pt == PAWN:
+                attacks |= _step_attacks(pieces[PAWN], PAWN_DIRECTIONS[color])
+            elif pt == KNIGHT:
+                attacks |= _step_attacks(pieces[KNIGHT], KNIGHT_DIRECTIONS)
+            elif pt == KING:
+                attacks |= _step_attacks(pieces[KING], KING_DIRECTIONS)
+            else:
+                if pt != ROOK:
+                    diagonal |= pieces[pt]
+                if pt != BISHOP:
+                    straight |= pieces[pt]
+        empty = ~self.occupied
+        attacks |= _slider_attacks(diagonal, empty, BISHOP_DIRECTIONS)
+        attacks |= _slider_attacks(straight, empty, ROOK_DIRECTIONS)
+        return attacks
+
+    def counts(self, color, piece_type = 0):
+        """ number of pieces of the given color and type (all pieces for type 0) """
+        return popcount(self.pieces[int(color)][piece_type])
+
+    def material(self):
+        """ material balance (excluding kings), from white's perspective """
+        material = np.zeros(len(self), dtype=np.int32)
+        for piece_type in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN):
+            material += PIECE_VALUES[piece_type] * (self.counts(WHITE, piece_type) - self.counts(BLACK, piece_type))
+        return material
+
+    def pst(self, endgame = False):
+        """ piece square table balance, from white's perspective """
+        tables = EG_PST if endgame else MG_PST
+        score = np.zeros(len(self), dtype=np.int32)
+        for piece_type in PIECE_TYPES:
+            score += square_bits(self.pieces[WHITE][piece_type]) @ tables[piece_type][WHITE]
+            score -= square_bits(self.pieces[BLACK][piece_type]) @ tables[piece_type][BLACK]
+        return score
+
+def _pieces_mask(board, piece_type, color):
+    # works for both chess.Board and SearchBoard (which has no pieces_mask)
+    pieces = (None, board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings)
+    return pieces[piece_type] & board.occupied_co[color]
+
+# BATCHED EVALUATION
+# the terms of EvalBoard.evaluate, for a whole batch at once - with the mg and eg parts in separate arrays rather
+# than packed, since there's no need to save additions here. left out are the draw checks (stalemate and
+# insufficient material, which need move generation) and the king safety stats term - see bench.py batch for the
+# check against the scalar evaluation.
+#
+# mobility and king zone attacks are counted per piece in eval.py, but can be counted set-wise by direction: a
+# square can only be attacked from a given direction by the nearest piece in it, so adding up the squares that
+# all the sliders attack in each direction counts each slider's attacks (same for knights with each jump).
+
+def _score_array(scores):
+    scores = np.array(scores, dtype=np.int64)
+    return np.array([mg_value(int(x)) for x in scores.flat]).reshape(scores.shape), \
+           np.array([eg_value(int(x)) for x in scores.flat]).reshape(scores.shape)
+
+# (2, 7, 64) by [color][piece type][square], from white's perspective
+PSQ_MG, PSQ_EG = _score_array([[[0] * 64 if values is None else values for values in PIECE_SQUARE_VALUES[color]]
+                                for color in COLORS[::-1]])
+
+BB_SQUARES = [U64(bb) for bb in chess.BB_SQUARES]
+BB_FILES = [U64(bb) for bb in chess.BB_FILES]
+
+def _add(score, term, count):
+    # adds a packed score term times a count array (or bool array) to an [mg, eg] pair of arrays
+    score[0] += mg_value(term) * count
+    score[1] += eg_value(term) * count
+
+def _pawn_structure(score, pawns, their_pawns, color):
+    # doubled, passed, isolated and backward pawns of the color, from its own perspective
+    for bb_file in BB_FILES:
+        _add(score, DOUBLED_PAWN_SCORE, np.maximum(popcount(pawns & bb_file) - 1, 0))
+    for sq in range(8, 56):
+        on = (pawns & BB_SQUARES[sq]) != 0
+        if not on.any():
+            continue
+        relative_rank = chess.square_rank(sq) if color else 7 - chess.square_rank(sq)
+        passed = on & ((their_pawns & U64(PAWN_STOPPERS[color][sq])) == 0)
+        bonus = int(12 * (relative_rank/2))
+        score[0] += bonus * passed
+        score[1] += bonus * passed
+        isolated = on & ((pawns & U64(ADJACENT_FILES[sq & 7])) == 0)
+        _add(score, ISOLATED_PAWN_SCORE, isolated)
+        stop_square = sq + 8 if color else sq - 8
+        backward = (on & ~isolated & ((pawns & U64(PAWN_SUPPORT_MASKS[color][sq])) == 0) &
+                    ((their_pawns & U64(chess.BB_PAWN_ATTACKS[color][stop_square])) != 0))
+        _add(score, BACKWARD_PAWN_SCORE, backward)
+
+def _king_shelter(score, pawns, kings, color):
+    # pawn shield of a king on one of the shelter squares (see EvalBoard._king_pawns_eval), mg only
+    for king_sq in KING_SHELTER_SQUARES[color]:
+        on = (kings & BB_SQUARES[king_sq]) != 0
+        if not on.any():
+            continue
+        shields = PAWN_SHIELD_MASKS[king_sq]
+        shield_center = U64(2**(king_sq + 8 * (-1,1)[color]))
+        kp_val = np.where((pawns & shield_center) != 0, 15, -5)
+        kp_val += popcount(pawns & U64(shields[0])) * 20
+        kp_val += popcount(pawns & U64(shields[1])) * 10
+        for bb_file in BB_FILES:
+            shield_file = bb_file & U64(shields[0] | shields[1])
+            if shield_file:
+                open_file = (pawns & shield_file) == 0
+                kp_val -= 20 * open_file
+                if shield_file & shield_center:
+                    kp_val -= 25 * open_file
+        score[0] += kp_val * on
+
+def _piece_terms(score, batch, color):
+    # mobility, king zone attacks and bishop pair of the color, from its own perspective
+    pieces = batch.pieces[color]
+    empty = ~batch.occupied
+    king_zone = _step_attacks(batch.pieces[1 - color][KING], KING_DIRECTIONS)
+    mobility = np.zeros(len(batch), dtype=np.int32)
+    king_zone_attacks = np.zeros_like(mobility)
+    for sliders, directions in ((pieces[BISHOP] | pieces[QUEEN], BISHOP_DIRECTIONS),
+                                (pieces[ROOK] | pieces[QUEEN], ROOK_DIRECTIONS)):
+        for shift, mask in directions:
+            attacks = _slider_fill(sliders, empty, shift, mask)
+            mobility += popcount(attacks)
+            king_zone_attacks += popcount(attacks & king_zone)
+    for shift, mask in KNIGHT_DIRECTIONS:
+        king_zone_attacks += popcount(_shift(pieces[KNIGHT], shift) & mask & king_zone)
+    _add(score, MOBILITY_SCORE, mobility)
+    _add(score, KING_ZONE_ATTACK_SCORE, king_zone_attacks)
+    _add(score, BISHOP_PAIR_SCORE, popcount(pieces[BISHOP]) == 2)
+
+def evaluate_batch(positions):
+    """ evaluation of each position from the perspective of the side to move, as EvalBoard.evaluate - positions is
+        a PositionBatch, or boards to make one of """
+    batch = positions if isinstance(positions, PositionBatch) else PositionBatch.from_boards(positions)
+    n = len(batch)
+    mg = np.zeros(n, dtype=np.int64)
+    eg = np.zeros(n, dtype=np.int64)
+    phase = np.zeros(n, dtype=np.int64)
+    # material and piece squares
+    for color in COLORS:
+        for piece_type in PIECE_TYPES:
+            bits = square_bits(batch.pieces[color][piece_type])
+            mg += bits @ PSQ_MG[color][piece_type]
+            eg += bits @ PSQ_EG[color][piece_type]
+            phase += PHASE_WEIGHTS[piece_type] * batch.counts(color, piece_type)
+    # pawns and pieces, by color
+    for color in COLORS:
+        score = [np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)]
+        pawns = batch.pieces[color][PAWN]
+        _pawn_structure(score, pawns, batch.pieces[1 - color][PAWN], color)
+        _king_shelter(score, pawns, batch.pieces[color][KING], color)
+        _piece_terms(score, batch, color)
+        sign = 1 if color == WHITE else -1
+        mg += sign * score[0]
+        eg += sign * score[1]
+    phase = np.minimum(phase, MAX_PHASE)
+    ev = (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+    return np.where(batch.turn, ev, -ev)
@@ -0,0 +1,256 @@
+import argparse
+import chess
+import random
+import time
+
+from chess import BB_RANK_MASKS, BB_FILE_MASKS, BB_DIAG_MASKS, BB_RANK_ATTACKS, BB_FILE_ATTACKS, BB_DIAG_ATTACKS
+from attacks import BB_ROOK_MASKS, BB_ROOK_ATTACKS, BB_BISHOP_MASKS, BB_BISHOP_ATTACKS
+from batch import PositionBatch, evaluate_batch
+from board import SearchBoard
+from eval import EvalBoard, ENDGAME_PHASE
+
+# micro benchmarks for the low level board/eval code - see speedtest.py for search benchmarks
+
+POSITIONS = [
+    # starting position
+    chess.STARTING_FEN,
+    # kiwipete
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    # a position in the sicilian, as white
+    'rnbqkb1r/1p3ppp/p2p1n2/4p3/3NP3/2N1B3/PPP2PPP/R2QKB1R w KQkq - 0 7',
+    # a queen's gambit position
+    'rn1qk2r/p3bppp/bpp1pn2/3p4/2PP4/1PB2NP1/P3PPBP/RN1QK2R w KQkq - 0 9',
+    # an endgame position
+    '8/p6p/1p1Pk3/5p1p/1P3K1P/6P1/5P2/8 b - - 0 46',
+]
+
+# positions with a king on the other color's shelter squares, each after one with the same pawns (so the same pawn
+# hash entry) and the kings on their own - the evaluation checks below (cache, batch) go through them in order
+SHELTER_POSITIONS = [
+    '8/1R6/8/8/8/8/8/4k1K1 b - - 21 71',
+    '8/1R6/8/8/8/8/4K3/6k1 b - - 21 71',
+    '6k1/5ppp/8/q7/Q7/8/5PPP/6K1 w - - 0 1',
+    '6K1/5ppp/8/q7/Q7/8/5PPP/5k2 w - - 0 1',
+    '1k6/ppp5/8/7q/7Q/8/PPP5/1K6 w - - 0 1',
+    '1K6/ppp5/8/7q/7Q/8/PPP5/3k4 b - - 0 1',
+]
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+    pushpop = subparsers.add_parser('pushpop', help='push/pop pairs per second')
+    pushpop.add_argument('--iterations', default=200, type=int)
+    attacks = subparsers.add_parser('attacks', help='slider attack lookups per second')
+    attacks.add_argument('--iterations', default=200, type=int)
+    evaluate = subparsers.add_parser('eval', help='leaf evaluations per second')
+    evaluate.add_argument('--walks', default=300, type=int, help='random walks from each position')
+    evaluate.add_argument('--length', default=8, type=int, help='moves per walk')
+    evaluate.add_argument('--seed', default=1, type=int)
+    batch = subparsers.add_parser('batch', help='batched numpy evaluation vs. EvalBoard.evaluate, positions per second')
+    batch.add_argument('--walks', default=300, type=int, help='random walks from each position')
+    # (longer walks than for eval, to get to more of the positions after exchanges)
+    batch.add_argument('--length', default=30, type=int, help='moves per walk')
+    batch.add_argument('--seed', default=1, type=int)
+    cache = subparsers.add_parser('cache', help='checks that evaluations with cold and warm caches agree')
+    cache.add_argument('--walks', default=300, type=int, help='random walks from each position')
+    cache.add_argument('--length', default=8, type=int, help='moves per walk')
+    cache.add_argument('--seed', default=1, type=int)
+    return parser.parse_args()
+
+def bench_pushpop(args):
+    # python-chess push/pop (full board state snapshots, chess.Move) vs. our compact undo records (int moves)
+    for board_class in (chess.Board, SearchBoard):
+        pairs = 0
+        t = 0
+        for fen in POSITIONS:
+            board = board_class(fen)
+            moves = list(board.legal_moves)
+            push = board.push
+            pop = board.pop
+            t0 = time.time()
+            for _ in range(args.iterations):
+                for move in moves:
+                    push(move)
+                    pop()
+            t += time.time() - t0
+            pairs += args.iterations * len(moves)
+        print('%s.%s: %d pairs in %.2fs [%.1fk pairs/s]' %
+                (board_class.__module__, board_class.__name__, pairs, t, pairs / t / 1000))
+
+def bench_attacks(args):
+    # python-chess rank/file/diagonal tables vs. our combined rook and bishop tables,
+    # for every square with the occupancy of each of the positions
+    def chess_rook(samples):
+        for square, occupied in samples:
+            BB_RANK_ATTACKS[square][BB_RANK_MASKS[square] & occupied] | BB_FILE_ATTACKS[square][BB_FILE_MASKS[square] & occupied]
+
+    def chess_bishop(samples):
+        for square, occupied in samples:
+            BB_DIAG_ATTACKS[square][BB_DIAG_MASKS[square] & occupied]
+
+    def chess_queen(samples):
+        for square, occupied in samples:
+            (BB_RANK_ATTACKS[square][BB_RANK_MASKS[square] & occupied] | BB_FILE_ATTACKS[square][BB_FILE_MASKS[square] & occupied] |
+                BB_DIAG_ATTACKS[square][BB_DIAG_MASKS[square] & occupied])
+
+    def rook(samples):
+        for square, occupied in samples:
+            BB_ROOK_ATTACKS[square][BB_ROOK_MASKS[square] & occupied]
+
+    def bishop(samples):
+        for square, occupied in samples:
+            BB_BISHOP_ATTACKS[square][BB_BISHOP_MASKS[square] & occupied]
+
+    def queen(samples):
+        for square, occupied in samples:
+            BB_ROOK_ATTACKS[square][BB_ROOK_MASKS[square] & occupied] | BB_BISHOP_ATTACKS[square][BB_BISHOP_MASKS[square] & occupied]
+
+    samples = [(square, chess.Board(fen).occupied) for fen in POSITIONS for square in chess.SQUARES]
+    for name, chess_lookup, lookup in (('rook', chess_rook, rook), ('bishop', chess_bishop, bishop), ('queen', chess_queen, queen)):
+        # best of a few alternating rounds, to even out warm up effects
+        best = [None, None]
+        for _ in range(3):
+            for i, f in enumerate((chess_lookup, lookup)):
+                t0 = time.time()
+                for _ in range(args.iterations):
+                    f(samples)
+                t = time.time() - t0
+                best[i] = t if best[i] is None else min(best[i], t)
+        results = [args.iterations * len(samples) / t / 1000000 for t in best]
+        print('%s: python-chess %.2fM lookups/s, attacks %.2fM lookups/s [x%.2f]' % (name, results[0], results[1], results[1] / results[0]))
+
+def bench_eval(args):
+    # evaluates every position along seeded random walks from each of the positions, as search would at the leaves
+    # (walks mostly reach new positions, so the evals cache rarely hits, while the pawn and attack caches do as
+    # they would in search) - the time of the same walks with only push/pop is subtracted
+    rng = random.Random(args.seed)
+    evals = 0
+    t_walk = 0
+    t_eval = 0
+    for fen in POSITIONS:
+        board = EvalBoard(fen)
+        walks = []
+        for _ in range(args.walks):
+            walk = []
+            for _ in range(args.length):
+                moves = board.generate_legal_moves()
+                if not moves:
+                    break
+                walk.append(rng.choice(moves))
+                board.push(walk[-1])
+            for _ in walk:
+                board.pop()
+            walks.append(walk)
+            evals += len(walk)
+        for evaluate in (False, True):
+            t0 = time.time()
+            for walk in walks:
+                for move in walk:
+                    board.push(move)
+                    if evaluate:
+                        board.evaluate()
+                for _ in walk:
+                    board.pop()
+            t = time.time() - t0
+            if evaluate:
+                t_eval += t
+            else:
+                t_walk += t
+    t = t_eval - t_walk
+    print('%d evals in %.2fs [%.1fk evals/s] (push/pop %.2fs)' % (evals, t, evals / t / 1000, t_walk))
+
+def bench_batch(args):
+    # evaluates the positions along seeded random walks (as in bench_eval) both one at a time and as a batch, and
+    # checks that they agree - except where the scalar evaluation has terms the batch one doesn't: draws by
+    # stalemate or insufficient material, and the king safety stats
+    class Board(EvalBoard):
+        KING_SAFETY = False
+    rng = random.Random(args.seed)
+    boards = [chess.Board(fen) for fen in SHELTER_POSITIONS]
+    for fen in POSITIONS:
+        for _ in range(args.walks):
+            board = chess.Board(fen)
+            for _ in range(args.length):
+                moves = list(board.legal_moves)
+                if not moves:
+                    break
+                board.push(rng.choice(moves))
+                boards.append(board.copy(stack=False))
+    board = Board()
+    evals = []
+    t = 0
+    for b in boards:
+        board.set_board(b)
+        t0 = time.time()
+        evals.append(board.evaluate())
+        t += time.time() - t0
+    print('EvalBoard.evaluate: %d positions in %.2fs [%.1fk positions/s]' % (len(boards), t, len(boards) / t / 1000))
+    t0 = time.time()
+    batch = PositionBatch.from_boards(boards)
+    t_batch = time.time() - t0
+    t0 = time.time()
+    batch_evals = evaluate_batch(batch)
+    t = time.time() - t0
+    print('evaluate_batch: %d positions in %.2fs [%.1fk positions/s] (PositionBatch.from_boards %.2fs)' %
+            (len(boards), t, len(boards) / t / 1000, t_batch))
+    mismatches = 0
+    skipped = 0
+    for b, ev, batch_ev in zip(boards, evals, batch_evals):
+        board.set_board(b)
+        if board.phase <= ENDGAME_PHASE and (board.is_stalemate() or board.is_insufficient_material()):
+            skipped += 1
+        elif ev != batch_ev:
+            mismatches += 1
+            if mismatches <= 10:
+                print('mismatch: %s evaluate %d, evaluate_batch %d' % (b.fen(), ev, batch_ev))
+    print('%d positions checked, %s (%d draws skipped)' %
+            (len(boards) - skipped, '%d MISMATCHED' % mismatches if mismatches else 'all match', skipped))
+    return mismatches
+
+def bench_cache(args):
+    # evaluates the positions along seeded random walks (as in bench_eval), and the shelter positions, on a board
+    # whose caches are warmed by all the positions before, and on one whose caches are cleared for each - an eval
+    # that depends on what's already cached would make search results depend on the order of the search
+    class ColdBoard(EvalBoard):
+        HASH_SIZE = 16 # cleared for every position
+    rng = random.Random(args.seed)
+    boards = [chess.Board(fen) for fen in SHELTER_POSITIONS]
+    for fen in POSITIONS:
+        for _ in range(args.walks):
+            board = chess.Board(fen)
+            for _ in range(args.length):
+                moves = list(board.legal_moves)
+                if not moves:
+                    break
+                board.push(rng.choice(moves))
+                boards.append(board.copy(stack=False))
+    warm = EvalBoard()
+    cold = ColdBoard()
+    mismatches = 0
+    t0 = time.time()
+    for b in boards:
+        warm.set_board(b)
+        cold.set_board(b)
+        for table in cold.hash_tables():
+            table.clear()
+        warm_ev = warm.evaluate()
+        cold_ev = cold.evaluate()
+        if warm_ev != cold_ev:
+            mismatches += 1
+            if mismatches <= 10:
+                print('mismatch: %s warm %d, cold %d' % (b.fen(), warm_ev, cold_ev))
+    print('%d positions checked in %.2fs, %s' %
+            (len(boards), time.time() - t0, '%d MISMATCHED' % mismatches if mismatches else 'all match'))
+    return mismatches
+
+BENCHMARKS = {
+    'pushpop': bench_pushpop,
+    'attacks': bench_attacks,
+    'eval': bench_eval,
+    'batch': bench_batch,
+    'cache': bench_cache,
+}
+
+if __name__ == '__main__':
+    args = get_args()
+    BENCHMARKS[args.bench](args)
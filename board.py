@@ -1,7 +1,12 @@
 import chess
+import chess.polyglot
+
+from attacks import BB_ROOK_MASKS, BB_ROOK_ATTACKS, BB_BISHOP_MASKS, BB_BISHOP_ATTACKS
 
 between = chess.between
 msb = chess.msb
+popcount = chess.popcount
+ray = chess.ray
 scan_reversed = chess.scan_reversed
 square_file = chess.square_file
 square_rank = chess.square_rank
@@ -21,6 +26,9 @@ BB_FILE_F = chess.BB_FILE_F
 BB_FILE_G = chess.BB_FILE_G
 BB_FILES = chess.BB_FILES
 BB_ALL = chess.BB_ALL
+BB_RANKS = chess.BB_RANKS
+BB_DARK_SQUARES = chess.BB_DARK_SQUARES
+BB_LIGHT_SQUARES = chess.BB_LIGHT_SQUARES
 BB_SQUARES = chess.BB_SQUARES
 
 BB_RANK_3_4 = (BB_RANK_3 | BB_RANK_4)
@@ -31,8 +39,6 @@ BB_KING_ATTACKS = chess.BB_KING_ATTACKS
 BB_KNIGHT_ATTACKS = chess.BB_KNIGHT_ATTACKS
 
 BB_RANK_MASKS = chess.BB_RANK_MASKS
-BB_FILE_MASKS = chess.BB_FILE_MASKS
-BB_DIAG_MASKS = chess.BB_DIAG_MASKS
 BB_RANK_ATTACKS = chess.BB_RANK_ATTACKS
 BB_FILE_ATTACKS = chess.BB_FILE_ATTACKS
 BB_DIAG_ATTACKS = chess.BB_DIAG_ATTACKS
@@ -77,34 +83,93 @@ KING = chess.KING
 
 Move = chess.Move
 
-class Board(chess.Board):
+STARTING_FEN = chess.STARTING_FEN
 
-    def __init__(self, *arg, **kw):
-        super().__init__(*arg, **kw)
-        self._hash = None
+# ZOBRIST KEYS
+# we use the polyglot random array so that keys are identical to chess.polyglot.zobrist_hash
+
+POLYGLOT_RANDOM_ARRAY = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+
+Z_PIECES = [[[0] * 64 for _ in range(7)] for _ in range(2)] # [color][piece type][square]
+for piece_type in range(PAWN, KING + 1):
+    for color in (BLACK, WHITE):
+        for sq in range(64):
+            Z_PIECES[color][piece_type][sq] = POLYGLOT_RANDOM_ARRAY[64 * ((piece_type - 1) * 2 + color) + sq]
+
+BB_CORNERS = BB_AH1 | BB_AH8
+Z_CASTLING = {} # castling rights (subset of corner rooks) -> key
+for rights in range(16):
+    mask = 0
+    key = 0
+    for i, bb in enumerate((BB_H1, BB_A1, BB_H8, BB_A8)):
+        if rights & (1 << i):
+            mask |= bb
+            key ^= POLYGLOT_RANDOM_ARRAY[768 + i]
+    Z_CASTLING[mask] = key
+
+Z_EP = POLYGLOT_RANDOM_ARRAY[772:780] # by file
+Z_TURN = POLYGLOT_RANDOM_ARRAY[780] # white to move
+
+# MOVE ENCODING
+# moves in search are ints: from square (bits 0-5), to square (6-11), promotion piece type (12-14) and flags
+# chess.Move objects are used only at the edges, see SearchBoard.encode_move and decode_move
+
+NULL_MOVE = 0
+MOVE_SQUARES = 0xfff # from and to squares, used for indexing history tables
+MOVE_PROMOTION = 7 << 12
+MOVE_CAPTURE = 1 << 15
+MOVE_EP = 1 << 16
+MOVE_CASTLING = 1 << 17
+
+def decode_move(move):
+    if not move:
+        return Move.null()
+    return Move(move & 63, move >> 6 & 63, (move >> 12 & 7) or None)
+
+class BoardMixin(object):
+    # bitboard logic shared by the python-chess based Board, used at the edges (games, pgn, book),
+    # and the lean SearchBoard used by the engine - hashing, attacks and pins
+
+    __slots__ = ()
 
     def get_hash(self):
         if self._hash is None:
-            self._hash = self._transposition_key()
+            self._hash = self._zobrist_hash()
         return self._hash
 
+    def _zobrist_hash(self):
+        # full key computation - only needed when the position is set up, push maintains it from there on
+        h = 0
+        for color in (BLACK, WHITE):
+            z_pieces = Z_PIECES[color]
+            for sq in scan_reversed(self.occupied_co[color]):
+                h ^= z_pieces[self.piece_type_at(sq)][sq]
+        h ^= Z_CASTLING[self.clean_castling_rights() & BB_CORNERS]
+        h ^= self._ep_hash()
+        if self.turn:
+            h ^= Z_TURN
+        return h
+
+    def _ep_hash(self):
+        # like polyglot, the ep square is hashed only if there's a pawn that can capture it
+        ep_square = self.ep_square
+        if ep_square and BB_PAWN_ATTACKS[not self.turn][ep_square] & self.pawns & self.occupied_co[self.turn]:
+            return Z_EP[ep_square & 7]
+        return 0
+
     def king(self, color):
         """ returns king square """
         return msb(self.occupied_co[color] & self.kings)
 
     def _attackers_mask(self, color, square, occupied):
-        rank_pieces = BB_RANK_MASKS[square] & occupied
-        file_pieces = BB_FILE_MASKS[square] & occupied
-        diag_pieces = BB_DIAG_MASKS[square] & occupied
-
         queens_and_rooks = self.queens | self.rooks
         queens_and_bishops = self.queens | self.bishops
 
         attackers = (
             (BB_KING_ATTACKS[square] & self.kings) |
             (BB_KNIGHT_ATTACKS[square] & self.knights) |
-            ((BB_RANK_ATTACKS[square][rank_pieces] | BB_FILE_ATTACKS[square][file_pieces]) & queens_and_rooks) |
-            (BB_DIAG_ATTACKS[square][diag_pieces] & queens_and_bishops) |
+            (BB_ROOK_ATTACKS[square][BB_ROOK_MASKS[square] & occupied] & queens_and_rooks) |
+            (BB_BISHOP_ATTACKS[square][BB_BISHOP_MASKS[square] & occupied] & queens_and_bishops) |
             (BB_PAWN_ATTACKS[not color][square] & self.pawns))
 
         return attackers & self.occupied_co[color]
@@ -123,18 +188,14 @@ class Board(chess.Board):
             return True
 
         occupied = self.occupied
-        rank_pieces = BB_RANK_MASKS[square] & occupied
-        file_pieces = BB_FILE_MASKS[square] & occupied
-
         queens_and_rooks = self.queens | self.rooks
 
-        if ((BB_RANK_ATTACKS[square][rank_pieces]|BB_FILE_ATTACKS[square][file_pieces]) & queens_and_rooks) & color_pieces:
+        if (BB_ROOK_ATTACKS[square][BB_ROOK_MASKS[square] & occupied] & queens_and_rooks) & color_pieces:
             return True
 
-        diag_pieces = BB_DIAG_MASKS[square] & occupied
         queens_and_bishops = self.queens | self.bishops
 
-        if (BB_DIAG_ATTACKS[square][diag_pieces] & queens_and_bishops) & color_pieces:
+        if (BB_BISHOP_ATTACKS[square][BB_BISHOP_MASKS[square] & occupied] & queens_and_bishops) & color_pieces:
             return True
 
         return False
@@ -150,184 +211,529 @@ class Board(chess.Board):
         if bb_square & self.kings:
             return BB_KING_ATTACKS[square]
         if bb_square & self.bishops:
-            return BB_DIAG_ATTACKS[square][BB_DIAG_MASKS[square] & self.occupied]
+            return BB_BISHOP_ATTACKS[square][BB_BISHOP_MASKS[square] & self.occupied]
         if bb_square & self.rooks:
-            return (BB_RANK_ATTACKS[square][BB_RANK_MASKS[square] & self.occupied] |
-                        BB_FILE_ATTACKS[square][BB_FILE_MASKS[square] & self.occupied])
+            return BB_ROOK_ATTACKS[square][BB_ROOK_MASKS[square] & self.occupied]
         if bb_square & self.queens:
-            attacks = BB_DIAG_ATTACKS[square][BB_DIAG_MASKS[square] & self.occupied]
-            attacks |= (BB_RANK_ATTACKS[square][BB_RANK_MASKS[square] & self.occupied] |
-                        BB_FILE_ATTACKS[square][BB_FILE_MASKS[square] & self.occupied])
-            return attacks
+            return (BB_BISHOP_ATTACKS[square][BB_BISHOP_MASKS[square] & self.occupied] |
+                    BB_ROOK_ATTACKS[square][BB_ROOK_MASKS[square] & self.occupied])
         return 0
 
-    def push(self, move):
+    def piece_type_at(self, square):
+        mask = BB_SQUARES[square]
+        if not self.occupied & mask:
+            return None
+        elif self.pawns & mask:
+            return PAWN
+        elif self.knights & mask:
+            return KNIGHT
+        elif self.bishops & mask:
+            return BISHOP
+        elif self.rooks & mask:
+            return ROOK
+        elif self.queens & mask:
+            return QUEEN
+        else:
+            return KING
+
+    def attackers_mask(self, color, square):
+        return self._attackers_mask(color, square, self.occupied)
+
+    def pin_mask(self, color, square):
+        king = self.king(color)
+        square_mask = BB_SQUARES[square]
+        for attacks, sliders in ((BB_FILE_ATTACKS, self.rooks | self.queens),
+                                 (BB_RANK_ATTACKS, self.rooks | self.queens),
+                                 (BB_DIAG_ATTACKS, self.bishops | self.queens)):
+            rays = attacks[king][0]
+            if rays & square_mask:
+                snipers = rays & sliders & self.occupied_co[not color]
+                for sniper in scan_reversed(snipers):
+                    if between(sniper, king) & (self.occupied | square_mask) == square_mask:
+                        return ray(king, sniper)
+                break
+        return BB_ALL
+
+    def _slider_blockers(self, king):
+        rooks_and_queens = self.rooks | self.queens
+        bishops_and_queens = self.bishops | self.queens
+
+        snipers = ((BB_ROOK_ATTACKS[king][0] & rooks_and_queens) |
+                   (BB_BISHOP_ATTACKS[king][0] & bishops_and_queens))
+
+        blockers = 0
+        for sniper in scan_reversed(snipers & self.occupied_co[not self.turn]):
+            b = between(king, sniper) & self.occupied
+            # Add to blockers if exactly one piece in-between.
+            if b and BB_SQUARES[msb(b)] == b:
+                blockers |= b
+
+        return blockers & self.occupied_co[self.turn]
+
+    def clean_castling_rights(self):
+        """
+        Returns valid castling rights filtered from
+        :data:`~chess.Board.castling_rights`.
+        """
+        if self._stack:
+            # No new castling rights are assigned in a game, so we can assume
+            # they were filtered already.
+            return self.castling_rights
+
+        castling = self.castling_rights & self.rooks
+        white_castling = castling & BB_RANK_1 & self.occupied_co[WHITE]
+        black_castling = castling & BB_RANK_8 & self.occupied_co[BLACK]
+
+        # The rooks must be on a1, h1, a8 or h8.
+        white_castling &= BB_AH1
+        black_castling &= BB_AH8
+
+        # The kings must be on e1 or e8.
+        if not self.occupied_co[WHITE] & self.kings & BB_E1:
+            white_castling = 0
+        if not self.occupied_co[BLACK] & self.kings & BB_E8:
+            black_castling = 0
+
+        return white_castling | black_castling
+
+    def is_check(self):
+        return bool(self.attackers_mask(not self.turn, self.king(self.turn)))
+
+    def is_insufficient_material(self):
+        return self.has_insufficient_material(WHITE) and self.has_insufficient_material(BLACK)
+
+    def has_insufficient_material(self, color):
+        if self.occupied_co[color] & (self.pawns | self.rooks | self.queens):
+            return False
+
+        # Knights are only insufficient material if we have no other pieces and the opponent
+        # does not have pawns, knights, bishops or rooks (would allow selfmate).
+        if self.occupied_co[color] & self.knights:
+            return (popcount(self.occupied_co[color]) <= 2 and
+                    not (self.occupied_co[not color] & ~self.kings & ~self.queens))
+
+        # Bishops are only insufficient material if all bishops are on the same color
+        # and there are no pawns or knights.
+        if self.occupied_co[color] & self.bishops:
+            same_color = (not self.bishops & BB_DARK_SQUARES) or (not self.bishops & BB_LIGHT_SQUARES)
+            return same_color and not self.pawns and not self.knights
+
+        return True
+
+class SearchBoard(BoardMixin):
+    # a lean board for search - holds only what the engine needs, python-chess is used only
+    # to convert to and from chess.Board (see set_board/to_board) at the edges
+
+    __slots__ = ('pawns', 'knights', 'bishops', 'rooks', 'queens', 'kings', 'occupied_co', 'occupied',
+                 'turn', 'castling_rights', 'ep_square', 'halfmove_clock', 'fullmove_number',
+                 'move_stack', '_stack', '_hash', '_check_info', '_check_squares')
+
+    def __init__(self, fen = STARTING_FEN):
+        self.set_fen(fen)
+
+    def set_fen(self, fen):
+        self.set_board(chess.Board(fen))
+
+    def set_board(self, board):
+        """ sets position and move history from a chess.Board """
+        root = board.root()
+        self.pawns = root.pawns
+        self.knights = root.knights
+        self.bishops = root.bishops
+        self.rooks = root.rooks
+        self.queens = root.queens
+        self.kings = root.kings
+        self.occupied_co = [root.occupied_co[BLACK], root.occupied_co[WHITE]]
+        self.occupied = root.occupied
+        self.turn = root.turn
+        self.castling_rights = root.clean_castling_rights()
+        self.ep_square = root.ep_square
+        self.halfmove_clock = root.halfmove_clock
+        self.fullmove_number = root.fullmove_number
+        self.move_stack = []
+        self._stack = []
         self._hash = None
-        board_state = self._board_state()
-        self.castling_rights = self.clean_castling_rights()  # Before pushing stack
+        self._check_info = None
+        self._check_squares = None
+        for move in board.move_stack:
+            self.push(self.encode_move(move))
+
+    def to_board(self):
+        """ returns a Board with the same position and move history """
+        moves = []
+        while self.move_stack:
+            moves.append(self.pop())
+        board = Board(None)
+        board.pawns = self.pawns
+        board.knights = self.knights
+        board.bishops = self.bishops
+        board.rooks = self.rooks
+        board.queens = self.queens
+        board.kings = self.kings
+        board.occupied_co = [self.occupied_co[BLACK], self.occupied_co[WHITE]]
+        board.occupied = self.occupied
+        board.turn = self.turn
+        board.castling_rights = self.castling_rights
+        board.ep_square = self.ep_square
+        board.halfmove_clock = self.halfmove_clock
+        board.fullmove_number = self.fullmove_number
+        for move in reversed(moves):
+            self.push(move)
+            board.push(decode_move(move))
+        return board
+
+    def fen(self):
+        return self.to_board().fen()
+
+    def san(self, move):
+        return self.to_board().san(move)
+
+    def __str__(self):
+        return str(self.to_board())
+
+    def encode_move(self, move):
+        """ encodes a chess.Move, pseudo-legal in the current position, as an int move """
+        if not move:
+            return NULL_MOVE
+        from_square = move.from_square
+        to_square = move.to_square
+        m = from_square | to_square << 6
+        if move.promotion:
+            m |= move.promotion << 12
+        if BB_SQUARES[to_square] & self.occupied_co[not self.turn]:
+            m |= MOVE_CAPTURE
+        elif self.pawns & BB_SQUARES[from_square] and to_square == self.ep_square and (to_square - from_square) & 7:
+            m |= MOVE_CAPTURE | MOVE_EP
+        elif self.kings & BB_SQUARES[from_square] and to_square - from_square in (2, -2):
+            m |= MOVE_CASTLING
+        return m
+
+    def _xor_piece(self, piece_type, color, mask):
+        # toggles the given squares for a piece - used to put, remove and move (from|to mask) pieces
+        if piece_type == PAWN:
+            self.pawns ^= mask
+        elif piece_type == KNIGHT:
+            self.knights ^= mask
+        elif piece_type == BISHOP:
+            self.bishops ^= mask
+        elif piece_type == ROOK:
+            self.rooks ^= mask
+        elif piece_type == QUEEN:
+            self.queens ^= mask
+        else:
+            self.kings ^= mask
+        self.occupied_co[color] ^= mask
+        self.occupied ^= mask
+
+    def push(self, move):
+        # instead of a full board state, the undo stack keeps a compact record of what the move changed:
+        # (moved piece type, captured piece type, capture square, castling rights, ep square, halfmove clock,
+        #  check info, check squares, hash)
+        # pop then undoes the move by applying it in reverse - the check context of the position (see
+        # _get_check_info) is kept as well, so it's still there when we're back from searching the child node
+        key = self.get_hash()
+        turn = self.turn
+        castling_rights = self.castling_rights
+        ep_square = self.ep_square
+        halfmove_clock = self.halfmove_clock
         self.move_stack.append(move)
-        self._stack.append(board_state)
 
         # Reset en passant square.
-        ep_square = self.ep_square
+        if ep_square:
+            key ^= self._ep_hash()
         self.ep_square = None
+        key ^= Z_TURN
 
         # Increment move counters.
         self.halfmove_clock += 1
-        if self.turn == BLACK:
+        if turn == BLACK:
             self.fullmove_number += 1
 
         # On a null move, simply swap turns and reset the en passant square.
         if not move:
-            self.turn = not self.turn
+            self._stack.append((None, None, None, castling_rights, ep_square, halfmove_clock,
+                                self._check_info, self._check_squares, self._hash))
+            self._check_info = None
+            self._check_squares = None
+            self.turn = not turn
+            self._hash = key
             return
 
-        from_bb = BB_SQUARES[move.from_square]
-        to_bb = BB_SQUARES[move.to_square]
+        from_square = move & 63
+        to_square = move >> 6 & 63
+        from_bb = BB_SQUARES[from_square]
+        to_bb = BB_SQUARES[to_square]
+        z_pieces = Z_PIECES[turn]
 
-        piece_type = self._remove_piece_at(move.from_square)
+        piece_type = self.piece_type_at(from_square)
+        captured_piece_type = None
+        capture_square = to_square
 
-        # Update castling rights.
-        # note: castling rights is simply the disjuction of rooks that are eligible for castling
-        self.castling_rights &= ~to_bb & ~from_bb
-
-        # Handle castling.
-        if piece_type == KING:
-            castling = False
-            if self.turn == WHITE:
-                self.castling_rights &= ~BB_RANK_1
-                if move.from_square == E1:
-                    if move.to_square == G1:
-                        castling = True
-                        rook_square = H1
-                        rook_to_square = F1
-                    elif move.to_square == C1:
-                        castling = True
-                        rook_square = A1
-                        rook_to_square = D1
+        if move & MOVE_CASTLING:
+            if to_square > from_square:
+                rook_square = to_square + 1
+                rook_to_square = to_square - 1
             else:
-                self.castling_rights &= ~BB_RANK_8
-                if move.from_square == E8:
-                    if move.to_square == G8:
-                        castling = True
-                        rook_square = H8
-                        rook_to_square = F8
-                    elif move.to_square == C8:
-                        castling = True
-                        rook_square = A8
-                        rook_to_square = D8
-
-            if castling:
-                self._remove_piece_at(move.from_square)
-                self._remove_piece_at(rook_square)
-                self._set_piece_at(move.to_square, KING, self.turn)
-                self._set_piece_at(rook_to_square, ROOK, self.turn)
-                self.turn = not self.turn
-                return ROOK
-
-        capture_square = move.to_square
-        captured_piece_type = self.piece_type_at(capture_square)
-        promoted = False
-
-        # Handle special pawn moves.
-        if piece_type == PAWN:
-            # zeroing move
-            self.halfmove_clock = 0
-            diff = move.to_square - move.from_square
-
-            if diff == 16 and square_rank(move.from_square) == 1:
-                self.ep_square = move.from_square + 8
-            elif diff == -16 and square_rank(move.from_square) == 6:
-                self.ep_square = move.from_square - 8
-            elif move.to_square == ep_square and abs(diff) in [7, 9] and not captured_piece_type:
-                # Remove pawns captured en passant.
-                down = -8 if self.turn == WHITE else 8
-                capture_square = ep_square + down
-                captured_piece_type = self._remove_piece_at(capture_square)
-
-            if move.promotion:
-                piece_type = move.promotion
-                promoted = True
-
-        # Put the piece on the target square.
-        self._set_piece_at(move.to_square, piece_type, self.turn, promoted)
+                rook_square = to_square - 2
+                rook_to_square = to_square + 1
+            self._xor_piece(KING, turn, from_bb | to_bb)
+            self._xor_piece(ROOK, turn, BB_SQUARES[rook_square] | BB_SQUARES[rook_to_square])
+            key ^= (z_pieces[KING][from_square] ^ z_pieces[KING][to_square] ^
+                    z_pieces[ROOK][rook_square] ^ z_pieces[ROOK][rook_to_square])
+        else:
+            if move & MOVE_CAPTURE:
+                # zeroing move
+                self.halfmove_clock = 0
+                if move & MOVE_EP:
+                    capture_square = to_square + (-8 if turn == WHITE else 8)
+                    captured_piece_type = PAWN
+                else:
+                    captured_piece_type = self.piece_type_at(to_square)
+                self._xor_piece(captured_piece_type, not turn, BB_SQUARES[capture_square])
+                key ^= Z_PIECES[not turn][captured_piece_type][capture_square]
+
+            if piece_type == PAWN:
+                # zeroing move
+                self.halfmove_clock = 0
+                diff = to_square - from_square
+                if diff == 16:
+                    self.ep_square = from_square + 8
+                elif diff == -16:
+                    self.ep_square = from_square - 8
+
+            # Move the piece to the target square.
+            promotion = move >> 12 & 7
+            if promotion:
+                self._xor_piece(PAWN, turn, from_bb)
+                self._xor_piece(promotion, turn, to_bb)
+                key ^= z_pieces[PAWN][from_square] ^ z_pieces[promotion][to_square]
+            else:
+                self._xor_piece(piece_type, turn, from_bb | to_bb)
+                key ^= z_pieces[piece_type][from_square] ^ z_pieces[piece_type][to_square]
 
-        if captured_piece_type:
-            # zeroing move
-            self.halfmove_clock = 0
-            self._push_capture(move, capture_square, captured_piece_type, promoted)
+        # Update castling rights.
+        # note: castling rights is simply the disjuction of rooks that are eligible for castling
+        if castling_rights:
+            new_castling_rights = castling_rights & ~to_bb & ~from_bb
+            if piece_type == KING:
+                new_castling_rights &= ~(BB_RANK_1 if turn == WHITE else BB_RANK_8)
+            if new_castling_rights != castling_rights:
+                key ^= Z_CASTLING[castling_rights] ^ Z_CASTLING[new_castling_rights]
+                self.castling_rights = new_castling_rights
+
+        self._stack.append((piece_type, captured_piece_type, capture_square, castling_rights, ep_square,
+                            halfmove_clock, self._check_info, self._check_squares, self._hash))
+        self._check_info = None
+        self._check_squares = None
 
         # Swap turn.
-        self.turn = not self.turn
+        self.turn = not turn
+
+        if self.ep_square:
+            key ^= self._ep_hash()
+        self._hash = key
 
     def pop(self):
-        self._hash = None
         move = self.move_stack.pop()
-        self._stack.pop().restore(self)
-        return move
+        (piece_type, captured_piece_type, capture_square, castling_rights, ep_square,
+                halfmove_clock, self._check_info, self._check_squares, key) = self._stack.pop()
 
-    def _to_chess960(self, move):
-        if move.from_square == E1 and self.kings & BB_E1:
-            if move.to_square == G1 and not self.rooks & BB_G1:
-                return Move(E1, H1)
-            elif move.to_square == C1 and not self.rooks & BB_C1:
-                return Move(E1, A1)
-        elif move.from_square == E8 and self.kings & BB_E8:
-            if move.to_square == G8 and not self.rooks & BB_G8:
-                return Move(E8, H8)
-            elif move.to_square == C8 and not self.rooks & BB_C8:
-                return Move(E8, A8)
+        self.turn = turn = not self.turn
+        if turn == BLACK:
+            self.fullmove_number -= 1
+        self.castling_rights = castling_rights
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        self._hash = key
+
+        if not move:
+            return move
+
+        from_square = move & 63
+        to_square = move >> 6 & 63
+        from_bb = BB_SQUARES[from_square]
+        to_bb = BB_SQUARES[to_square]
+
+        if move & MOVE_CASTLING:
+            if to_square > from_square:
+                rook_squares = BB_SQUARES[to_square + 1] | BB_SQUARES[to_square - 1]
+            else:
+                rook_squares = BB_SQUARES[to_square - 2] | BB_SQUARES[to_square + 1]
+            self._xor_piece(KING, turn, from_bb | to_bb)
+            self._xor_piece(ROOK, turn, rook_squares)
+            return move
+
+        promotion = move >> 12 & 7
+        if promotion:
+            self._xor_piece(promotion, turn, to_bb)
+            self._xor_piece(PAWN, turn, from_bb)
+        else:
+            self._xor_piece(piece_type, turn, from_bb | to_bb)
+
+        if captured_piece_type:
+            self._xor_piece(captured_piece_type, not turn, BB_SQUARES[capture_square])
 
         return move
 
-    def _from_chess960(self, chess960, from_square, to_square, promotion = None, drop = None):
-        if from_square == E1 and self.kings & BB_E1:
-            if to_square == H1:
-                return Move(E1, G1)
-            elif to_square == A1:
-                return Move(E1, C1)
-        elif from_square == E8 and self.kings & BB_E8:
-            if to_square == H8:
-                return Move(E8, G8)
-            elif to_square == A8:
-                return Move(E8, C8)
-        return Move(from_square, to_square, promotion, drop)
+    def is_search_draw(self, ply):
+        # fifty-move rule or repetition, for use in search: a position that already occurred within the
+        # last ply plies (i.e. inside the search tree) is scored as a draw on its first repetition, one
+        # from before the search only on its third occurrence.
+        # the keys are in the undo records, and only plies since the last irreversible move (or null
+        # move, across which there are no real repetitions) need to be looked at
+        halfmove_clock = self.halfmove_clock
+        if halfmove_clock >= 100:
+            return True
+        key = self.get_hash()
+        stack = self._stack
+        count = 0
+        for i in range(1, min(halfmove_clock, len(stack)) + 1):
+            record = stack[-i]
+            if record[0] is None:
+                break
+            if record[-1] == key and not i & 1:
+                if i <= ply:
+                    return True
+                count += 1
+                if count == 2:
+                    return True
+        return False
 
-    
-    def clean_castling_rights(self):
-        """
-        Returns valid castling rights filtered from
-        :data:`~chess.Board.castling_rights`.
-        """
-        if self._stack:
-            # No new castling rights are assigned in a game, so we can assume
-            # they were filtered already.
-            return self.castling_rights
+    def _get_check_info(self):
+        # king square, checkers and pinned pieces (slider blockers) of the side to move, computed once per
+        # position and shared by move generation, is_check and checkmate detection
+        info = self._check_info
+        if info is None:
+            king = self.king(self.turn)
+            info = self._check_info = (king, self.attackers_mask(not self.turn, king), self._slider_blockers(king))
+        return info
+
+    def _get_check_squares(self):
+        # for checks against the opponent: their king square, the squares from which each of our piece
+        # types would give check, and our pieces that would give a discovered check by moving off the line
+        check_squares = self._check_squares
+        if check_squares is None:
+            turn = self.turn
+            king = self.king(not turn)
+            occupied = self.occupied
+            bishop_squares = BB_BISHOP_ATTACKS[king][BB_BISHOP_MASKS[king] & occupied]
+            rook_squares = BB_ROOK_ATTACKS[king][BB_ROOK_MASKS[king] & occupied]
+            squares = [0, BB_PAWN_ATTACKS[not turn][king], BB_KNIGHT_ATTACKS[king],
+                       bishop_squares, rook_squares, bishop_squares | rook_squares, 0]
+
+            ours = self.occupied_co[turn]
+            snipers = ours & ((BB_ROOK_ATTACKS[king][0] & (self.rooks | self.queens)) |
+                              (BB_BISHOP_ATTACKS[king][0] & (self.bishops | self.queens)))
+            discoverers = 0
+            for sniper in scan_reversed(snipers):
+                b = between(king, sniper) & occupied
+                if b and BB_SQUARES[msb(b)] == b:
+                    discoverers |= b
+
+            check_squares = self._check_squares = (king, squares, discoverers & ours)
+        return check_squares
+
+    def _ep_skewered(self, king, capturer):
+        # Handle the special case where the king would be in check if the
+        # pawn and its capturer disappear from the rank.
+        last_double = self.ep_square + (-8 if self.turn == WHITE else 8)
+
+        occupancy = (self.occupied & ~BB_SQUARES[last_double] &
+                     ~BB_SQUARES[capturer] | BB_SQUARES[self.ep_square])
+
+        # Horizontal attack on the fifth or fourth rank.
+        horizontal_attackers = self.occupied_co[not self.turn] & (self.rooks | self.queens)
+        if BB_RANK_ATTACKS[king][BB_RANK_MASKS[king] & occupancy] & horizontal_attackers:
+            return True
 
-        castling = self.castling_rights & self.rooks
-        white_castling = castling & BB_RANK_1 & self.occupied_co[WHITE]
-        black_castling = castling & BB_RANK_8 & self.occupied_co[BLACK]
+        # Diagonal skewers.
+        diagonal_attackers = self.occupied_co[not self.turn] & (self.bishops | self.queens)
+        if BB_BISHOP_ATTACKS[king][BB_BISHOP_MASKS[king] & occupancy] & diagonal_attackers:
+            return True
 
-        # The rooks must be on a1, h1, a8 or h8.
-        white_castling &= BB_AH1
-        black_castling &= BB_AH8
+        return False
 
-        # The kings must be on e1 or e8.
-        if not self.occupied_co[WHITE] & self.kings & BB_E1:
-            white_castling = 0
-        if not self.occupied_co[BLACK] & self.kings & BB_E8:
-            black_castling = 0
+    def _is_safe(self, king, blockers, move):
+        from_square = move & 63
+        to_square = move >> 6 & 63
+        if from_square == king:
+            if move & MOVE_CASTLING:
+                return True
+            else:
+                return not self.is_attacked_by(not self.turn, to_square)
+        elif move & MOVE_EP:
+            return bool(self.pin_mask(self.turn, from_square) & BB_SQUARES[to_square] and
+                        not self._ep_skewered(king, from_square))
+        else:
+            return bool(not blockers & BB_SQUARES[from_square] or
+                        ray(from_square, to_square) & BB_SQUARES[king])
 
-        return white_castling | black_castling
+    def _generate_evasions(self, king, checkers, from_mask = BB_ALL, to_mask = BB_ALL):
+        sliders = checkers & (self.bishops | self.rooks | self.queens)
+
+        attacked = 0
+        for checker in scan_reversed(sliders):
+            attacked |= ray(king, checker) & ~BB_SQUARES[checker]
+
+        moves = []
+        if BB_SQUARES[king] & from_mask:
+            their_pieces = self.occupied_co[not self.turn]
+            for to_square in scan_reversed(BB_KING_ATTACKS[king] & ~self.occupied_co[self.turn] & ~attacked & to_mask):
+                moves.append(king | to_square << 6 | (MOVE_CAPTURE if BB_SQUARES[to_square] & their_pieces else 0))
+
+        checker = msb(checkers)
+        if BB_SQUARES[checker] == checkers:
+            # Capture or block a single checker.
+            target = between(king, checker) | checkers
+
+            moves += self.generate_pseudo_legal_moves(~self.kings & from_mask, target & to_mask)
+
+            # Capture the checking pawn en passant (but avoid yielding
+            # duplicate moves).
+            if self.ep_square and not BB_SQUARES[self.ep_square] & target:
+                last_double = self.ep_square + (-8 if self.turn == WHITE else 8)
+                if last_double == checker:
+                    moves += self.generate_pseudo_legal_ep(from_mask, to_mask)
+
+        return moves
+
+    def _attacked_for_king(self, path, occupied):
+        return any(self._attackers_mask(not self.turn, sq, occupied) for sq in scan_reversed(path))
 
     @property
     def legal_moves(self):
         return self.generate_legal_moves()
 
+    @property
+    def pseudo_legal_moves(self):
+        # evasions when in check, so that is_legal can be used to filter them
+        king, checkers, blockers = self._get_check_info()
+        if checkers:
+            return self._generate_evasions(king, checkers)
+        return self.generate_pseudo_legal_moves()
+
+    def is_pseudo_legal(self, move):
+        # for moves that aren't from pseudo_legal_moves (e.g. a tt move, whose entry could be another position's)
+        from_mask = BB_SQUARES[move & 63]
+        if not from_mask & self.occupied_co[self.turn]:
+            return False
+        to_mask = BB_SQUARES[move >> 6 & 63]
+        if move & MOVE_CASTLING:
+            # castling moves are generated by the rook's square
+            to_mask = BB_ALL
+        king, checkers, blockers = self._get_check_info()
+        if checkers:
+            return move in self._generate_evasions(king, checkers, from_mask, to_mask)
+        return move in self.generate_pseudo_legal_moves(from_mask, to_mask)
+
+    def is_legal(self, move):
+        # for moves from pseudo_legal_moves only - a pin test (or attack test for king moves)
+        # using the check info of the position
+        king, checkers, blockers = self._get_check_info()
+        return self._is_safe(king, blockers, move)
+
     def generate_legal_moves(self, from_mask = BB_ALL, to_mask = BB_ALL):
-        king = self.king(self.turn)
-        blockers = self._slider_blockers(king)
-        checkers = self.attackers_mask(not self.turn, king)
+        king, checkers, blockers = self._get_check_info()
         if checkers:
             return [move for move in self._generate_evasions(king, checkers, from_mask, to_mask)
                     if self._is_safe(king, blockers, move)]
@@ -349,7 +755,7 @@ class Board(chess.Board):
         bb_g = BB_FILE_G & backrank
 
         king_sq = msb(king)
-        for candidate in scan_reversed(self.clean_castling_rights() & backrank & to_mask):
+        for candidate in scan_reversed(self.castling_rights & backrank & to_mask):
             rook = BB_SQUARES[candidate]
 
             a_side = rook < king
@@ -364,23 +770,29 @@ class Board(chess.Board):
             if not (oc_king_rook & (king_path | rook_path | king_to | rook_to) or
                     self._attacked_for_king(king_path | king, oc_king) or
                     self._attacked_for_king(king_to, oc_king_rook ^ rook_to)):
-                moves.append(self._from_chess960(self.chess960, king_sq, candidate))
+                moves.append(king_sq | msb(king_to) << 6 | MOVE_CASTLING)
 
         return moves
 
     def generate_pseudo_legal_moves(self, from_mask = BB_ALL, to_mask = BB_ALL):
-        our_pieces = self.occupied_co[self.turn]
+        turn = self.turn
+        our_pieces = self.occupied_co[turn]
+        their_pieces = self.occupied_co[not turn]
+        result = []
+        append = result.append
 
         # Generate piece moves.
         non_pawns = our_pieces & ~self.pawns & from_mask
-        result = []
         for from_square in scan_reversed(non_pawns):
             moves = self.attacks_mask(from_square) & ~our_pieces & to_mask
             for to_square in scan_reversed(moves):
-                result.append(Move(from_square, to_square))
+                if BB_SQUARES[to_square] & their_pieces:
+                    append(from_square | to_square << 6 | MOVE_CAPTURE)
+                else:
+                    append(from_square | to_square << 6)
 
         # Generate castling moves.
-        if from_mask & self.kings:
+        if from_mask & self.kings and self.castling_rights:
             result += self.generate_castling_moves(from_mask, to_mask)
 
         # The remaining moves are all pawn moves.
@@ -391,21 +803,20 @@ class Board(chess.Board):
         # Generate pawn captures.
         capturers = pawns
         for from_square in scan_reversed(capturers):
-            targets = (
-                BB_PAWN_ATTACKS[self.turn][from_square] &
-                self.occupied_co[not self.turn] & to_mask)
+            targets = BB_PAWN_ATTACKS[turn][from_square] & their_pieces & to_mask
 
             for to_square in scan_reversed(targets):
+                move = from_square | to_square << 6 | MOVE_CAPTURE
                 if square_rank(to_square) in [0, 7]:
-                    result.append(Move(from_square, to_square, QUEEN))
-                    result.append(Move(from_square, to_square, ROOK))
-                    result.append(Move(from_square, to_square, BISHOP))
-                    result.append(Move(from_square, to_square, KNIGHT))
+                    append(move | QUEEN << 12)
+                    append(move | ROOK << 12)
+                    append(move | BISHOP << 12)
+                    append(move | KNIGHT << 12)
                 else:
-                    result.append(Move(from_square, to_square))
+                    append(move)
 
         # Prepare pawn advance generation.
-        if self.turn == WHITE:
+        if turn == WHITE:
             single_moves = pawns << 8 & ~self.occupied
             double_moves = single_moves << 8 & ~self.occupied & BB_RANK_3_4
         else:
@@ -417,27 +828,40 @@ class Board(chess.Board):
 
         # Generate single pawn moves.
         for to_square in scan_reversed(single_moves):
-            from_square = to_square + (8 if self.turn == BLACK else -8)
+            from_square = to_square + (8 if turn == BLACK else -8)
+            move = from_square | to_square << 6
 
             if square_rank(to_square) in [0, 7]:
-                result.append(Move(from_square, to_square, QUEEN))
-                result.append(Move(from_square, to_square, ROOK))
-                result.append(Move(from_square, to_square, BISHOP))
-                result.append(Move(from_square, to_square, KNIGHT))
+                append(move | QUEEN << 12)
+                append(move | ROOK << 12)
+                append(move | BISHOP << 12)
+                append(move | KNIGHT << 12)
             else:
-                result.append(Move(from_square, to_square))
+                append(move)
 
         # Generate double pawn moves.
         for to_square in scan_reversed(double_moves):
-            from_square = to_square + (16 if self.turn == BLACK else -16)
-            result.append(Move(from_square, to_square))
+            from_square = to_square + (16 if turn == BLACK else -16)
+            append(from_square | to_square << 6)
 
         # Generate en passant captures.
         if self.ep_square:
-            result += [m for m in self.generate_pseudo_legal_ep(from_mask, to_mask)]
+            result += self.generate_pseudo_legal_ep(from_mask, to_mask)
 
         return result
 
+    def generate_pseudo_legal_ep(self, from_mask = BB_ALL, to_mask = BB_ALL):
+        ep_square = self.ep_square
+        if not ep_square or not BB_SQUARES[ep_square] & to_mask or BB_SQUARES[ep_square] & self.occupied:
+            return []
+
+        capturers = (
+            self.pawns & self.occupied_co[self.turn] & from_mask &
+            BB_PAWN_ATTACKS[not self.turn][ep_square] &
+            BB_RANKS[4 if self.turn else 3])
+
+        return [capturer | ep_square << 6 | MOVE_CAPTURE | MOVE_EP for capturer in scan_reversed(capturers)]
+
     def has_any_pseudo_legal_moves(self):
         our_pieces = self.occupied_co[self.turn]
 
@@ -479,7 +903,7 @@ class Board(chess.Board):
         if single_moves or double_moves:
             return True
 
-        if self.ep_square and any(self.generate_pseudo_legal_ep()):
+        if self.ep_square and self.generate_pseudo_legal_ep():
             return True
         
         return False
@@ -489,3 +913,96 @@ class Board(chess.Board):
             return False
 
         return not self.has_any_pseudo_legal_moves()
+
+    def is_check(self):
+        return bool(self._get_check_info()[1])
+
+    def gives_check(self, move):
+        if move & (MOVE_EP | MOVE_CASTLING):
+            # rare, and can uncover checks that the check squares don't account for
+            self.push(move)
+            try:
+                return self.is_check()
+            finally:
+                self.pop()
+
+        king, squares, discoverers = self._get_check_squares()
+        from_square = move & 63
+        to_square = move >> 6 & 63
+        to_bb = BB_SQUARES[to_square]
+
+        promotion = move >> 12 & 7
+        if promotion:
+            # the promoted piece may be checking through the square the pawn just left
+            if promotion == KNIGHT:
+                attacks = BB_KNIGHT_ATTACKS[to_square]
+            else:
+                occupied = self.occupied & ~BB_SQUARES[from_square]
+                attacks = 0
+                if promotion != ROOK:
+                    attacks |= BB_BISHOP_ATTACKS[to_square][BB_BISHOP_MASKS[to_square] & occupied]
+                if promotion != BISHOP:
+                    attacks |= BB_ROOK_ATTACKS[to_square][BB_ROOK_MASKS[to_square] & occupied]
+            if attacks & BB_SQUARES[king]:
+                return True
+        elif squares[self.piece_type_at(from_square)] & to_bb:
+            return True
+
+        # discovered check
+        return bool(discoverers & BB_SQUARES[from_square] and not ray(king, from_square) & to_bb)
+
+    def is_capture(self, move):
+        return bool(move & MOVE_CAPTURE)
+
+    def is_en_passant(self, move):
+        return bool(move & MOVE_EP)
+
+    def is_castling(self, move):
+        return bool(move & MOVE_CASTLING)
+
+class Board(BoardMixin, chess.Board):
+    # python-chess board with chess.Move moves - the key is computed lazily, as it's not used in search
+
+    def __init__(self, *arg, **kw):
+        super().__init__(*arg, **kw)
+        self._hash = None
+
+    def clear_stack(self):
+        super().clear_stack()
+        # called whenever the position is set up or edited
+        self._hash = None
+
+    def push(self, move):
+        super().push(move)
+        self._hash = None
+
+    def pop(self):
+        self._hash = None
+        return super().pop()
+
+    def _to_chess960(self, move):
+        if move.from_square == E1 and self.kings & BB_E1:
+            if move.to_square == G1 and not self.rooks & BB_G1:
+                return Move(E1, H1)
+            elif move.to_square == C1 and not self.rooks & BB_C1:
+                return Move(E1, A1)
+        elif move.from_square == E8 and self.kings & BB_E8:
+            if move.to_square == G8 and not self.rooks & BB_G8:
+                return Move(E8, H8)
+            elif move.to_square == C8 and not self.rooks & BB_C8:
+                return Move(E8, A8)
+
+        return move
+
+    def _from_chess960(self, chess960, from_square, to_square, promotion = None, drop = None):
+        if from_square == E1 and self.kings & BB_E1:
+            if to_square == H1:
+                return Move(E1, G1)
+            elif to_square == A1:
+                return Move(E1, C1)
+        elif from_square == E8 and self.kings & BB_E8:
+            if to_square == H8:
+                return Move(E8, G8)
+            elif to_square == A8:
+                return Move(E8, C8)
+        return Move(from_square, to_square, promotion, drop)
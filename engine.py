@@ -1,19 +1,15 @@
 import chess
 import chess.polyglot
 import chess.svg
-import random
 import time
 
-from collections import namedtuple
 from IPython.display import SVG, display
 
-from eval import EvalBoard as Board
-
-Entry = namedtuple('Entry', ['val', 'type', 'depth'])
-# Entry types
-EXACT = 0
-LOWER = 1
-UPPER = 2
+from attacks import BB_ROOK_MASKS, BB_ROOK_ATTACKS, BB_BISHOP_MASKS, BB_BISHOP_ATTACKS
+from board import Board, decode_move, MOVE_CAPTURE, MOVE_EP, MOVE_PROMOTION, MOVE_SQUARES, NULL_MOVE
+from eval import EvalBoard
+import instrument
+from tt import TranspositionTable, EXACT, LOWER, UPPER
 
 WHITE = chess.WHITE
 BLACK = chess.BLACK
@@ -26,17 +22,12 @@ QUEEN = chess.QUEEN
 KING = chess.KING
 
 BB_FILES = chess.BB_FILES
-NULL_MOVE = chess.Move.null()
+# killers and counter moves are kept without capture flags, to match the same (quiet) move in sibling positions
+KILLER_MASK = ~(MOVE_CAPTURE | MOVE_EP)
 
-BB_RANK_MASKS = chess.BB_RANK_MASKS
-BB_FILE_MASKS = chess.BB_FILE_MASKS
-BB_DIAG_MASKS = chess.BB_DIAG_MASKS
 BB_RANK_2 = chess.BB_RANK_2
 BB_RANK_7 = chess.BB_RANK_7
 
-BB_RANK_ATTACKS = chess.BB_RANK_ATTACKS
-BB_FILE_ATTACKS = chess.BB_FILE_ATTACKS
-BB_DIAG_ATTACKS = chess.BB_DIAG_ATTACKS
 BB_KING_ATTACKS = chess.BB_KING_ATTACKS
 BB_KNIGHT_ATTACKS = chess.BB_KNIGHT_ATTACKS
 BB_PAWN_ATTACKS = chess.BB_PAWN_ATTACKS
@@ -69,8 +60,7 @@ class Engine(object):
     ENDGAME_DEPTH = DEPTH + 2
     MOVE_TIME_LIMIT = 1
 
-    TT_SIZE = 4e6 # 4e6 seems to cap around 2G - a bit more with iterative deepening
-    Z_HASHING = False
+    TT_MB = 24 # transposition table size - it's fixed, so this caps its memory for the whole game
 
     SQUARE_VALUE = 10 # value for each square attacked by a piece
     DEF_VALUE = .05 # value for each defender of a given square
@@ -78,6 +68,17 @@ class Engine(object):
     PIECE_VALUES = [-1, 100, 320, 330, 500, 900, 20000] # none, pawn, knight, bishop, rook, queen, king - list for efficiency
     MATE_SCORE = 99900
     INF = MATE_SCORE + 1
+    # iterative deepening searches each depth with a window this wide on either side of the previous depth's score,
+    # widening it (by this factor) on a fail
+    ASPIRATION_WINDOW = 100
+    ASPIRATION_WIDENING = 4
+    # time management: the clock is only checked every TIME_CHECK_NODES nodes, and the search is aborted once the
+    # move time (the hard limit) is over - but no new depth is started after SOFT_TIME_RATIO of it (the soft limit),
+    # since it's unlikely to be completed. the soft limit is extended by TIME_EXTENSION (up to the move time) when
+    # the search is unstable: on a root fail low, or when the best move changes between depths
+    TIME_CHECK_NODES = 256
+    SOFT_TIME_RATIO = .5
+    TIME_EXTENSION = 1.5
 
     KING_SHELTER_SQUARES = [(56,57,58,62,63),(0,1,2,6,7)]
     PAWN_SHIELD_MASKS = {
@@ -93,9 +94,6 @@ class Engine(object):
             62: (chess.SquareSet([53,54,55]).mask, chess.SquareSet([45,46,47]).mask),
             63: (chess.SquareSet([54,55]).mask, chess.SquareSet([46,47]).mask),
         }
-    KING_SURROUNDING_SQUARES = {
-            sq: list(chess.SquareSet(chess.BB_KING_ATTACKS[sq])) for sq in range(64)
-        }
 
     # DIRECTIONS
     N = 8
@@ -110,196 +108,34 @@ class Engine(object):
 
     BB_FILES_AH = chess.BB_FILE_A | chess.BB_FILE_H
 
-    # UTIL TABLES
-    ROOK_CASTLING_SQ = [0] * 64 # king new sq -> (old rook sq, new rook sq)
-    ROOK_CASTLING_SQ[2] = (0,3) # white queenside
-    ROOK_CASTLING_SQ[6] = (7,5) # white kingside
-    ROOK_CASTLING_SQ[58] = (56,59) # black queenside
-    ROOK_CASTLING_SQ[62] = (63,61) # black kingside
-
-    KNIGHT_ATTACK_TABLE = [2, 3, 4, 4, 4, 4, 3, 2, 3, 4, 6, 6, 6, 6, 4, 3, 4, 6, 8, 8, 8, 8, 6, 4, 4, 6, 8, 8, 8, 8, 6, 4, 4, 6, 8, 8, 8, 8, 6, 4, 4, 6, 8, 8, 8, 8, 6, 4, 3, 4, 6, 6, 6, 6, 4, 3, 2, 3, 4, 4, 4, 4, 3, 2]
-
-
-    # PIECE SQUARE TABLES
-
-    MG_PAWN_SQ_TABLE = [
-              0,   0,   0,   0,   0,   0,  0,   0,
-             98, 134,  61,  95,  68, 126, 34, -11,
-             -6,   7,  26,  31,  65,  56, 25, -20,
-            -14,  13,   6,  21,  23,  12, 17, -23,
-            -27,  -2,  -5,  12,  17,   6, 10, -25,
-            -26,  -4,  -4, -10,   3,   3, 33, -12,
-            -35,  -1, -20, -23, -15,  24, 38, -22,
-              0,   0,   0,   0,   0,   0,  0,  0,
-        ]
-
-    EG_PAWN_SQ_TABLE = [
-              0,   0,   0,   0,   0,   0,   0,   0,
-            178, 173, 158, 134, 147, 132, 165, 187,
-             94, 100,  85,  67,  56,  53,  82,  84,
-             32,  24,  13,   5,  -2,   4,  17,  17,
-             13,   9,  -3,  -7,  -7,  -8,   3,  -1,
-              4,   7,  -6,   1,   0,  -5,  -1,  -8,
-             13,   8,   8,  10,  13,   0,   2,  -7,
-              0,   0,   0,   0,   0,   0,   0,   0,
-        ]
-
-    MG_KNIGHT_SQ_TABLE = [
-            -167, -89, -34, -49,  61, -97, -15, -107,
-             -73, -41,  72,  36,  23,  62,   7,  -17,
-             -47,  60,  37,  65,  84, 129,  73,   44,
-              -9,  17,  19,  53,  37,  69,  18,   22,
-             -13,   4,  16,  13,  28,  19,  21,   -8,
-             -23,  -9,  12,  10,  19,  17,  25,  -16,
-             -29, -53, -12,  -3,  -1,  18, -14,  -19,
-            -105, -21, -58, -33, -17, -28, -19,  -23,
-        ]
-
-    EG_KNIGHT_SQ_TABLE = [
-            -58, -38, -13, -28, -31, -27, -63, -99,
-            -25,  -8, -25,  -2,  -9, -25, -24, -52,
-            -24, -20,  10,   9,  -1,  -9, -19, -41,
-            -17,   3,  22,  22,  22,  11,   8, -18,
-            -18,  -6,  16,  25,  16,  17,   4, -18,
-            -23,  -3,  -1,  15,  10,  -3, -20, -22,
-            -42, -20, -10,  -5,  -2, -20, -23, -44,
-            -29, -51, -23, -15, -22, -18, -50, -64,
-        ]
-
-    MG_BISHOP_SQ_TABLE = [
-            -29,   4, -82, -37, -25, -42,   7,  -8,
-            -26,  16, -18, -13,  30,  59,  18, -47,
-            -16,  37,  43,  40,  35,  50,  37,  -2,
-             -4,   5,  19,  50,  37,  37,   7,  -2,
-             -6,  13,  13,  26,  34,  12,  10,   4,
-              0,  15,  15,  15,  14,  27,  18,  10,
-              4,  15,  16,   0,   7,  21,  33,   1,
-            -33,  -3, -14, -21, -13, -12, -39, -21,
-        ]
-
-    EG_BISHOP_SQ_TABLE = [
-            -14, -21, -11,  -8, -7,  -9, -17, -24,
-             -8,  -4,   7, -12, -3, -13,  -4, -14,
-              2,  -8,   0,  -1, -2,   6,   0,   4,
-             -3,   9,  12,   9, 14,  10,   3,   2,
-             -6,   3,  13,  19,  7,  10,  -3,  -9,
-            -12,  -3,   8,  10, 13,   3,  -7, -15,
-            -14, -18,  -7,  -1,  4,  -9, -15, -27,
-            -23,  -9, -23,  -5, -9, -16,  -5, -17,
-        ]
-
-    MG_ROOK_SQ_TABLE = [
-             32,  42,  32,  51, 63,  9,  31,  43,
-             27,  32,  58,  62, 80, 67,  26,  44,
-             -5,  19,  26,  36, 17, 45,  61,  16,
-            -24, -11,   7,  26, 24, 35,  -8, -20,
-            -36, -26, -12,  -1,  9, -7,   6, -23,
-            -45, -25, -16, -17,  3,  0,  -5, -33,
-            -44, -16, -20,  -9, -1, 11,  -6, -71,
-            -19, -13,   1,  17, 16,  7, -37, -26,
-        ]
-
-    EG_ROOK_SQ_TABLE = [
-            13, 10, 18, 15, 12,  12,   8,   5,
-            11, 13, 13, 11, -3,   3,   8,   3,
-             7,  7,  7,  5,  4,  -3,  -5,  -3,
-             4,  3, 13,  1,  2,   1,  -1,   2,
-             3,  5,  8,  4, -5,  -6,  -8, -11,
-            -4,  0, -5, -1, -7, -12,  -8, -16,
-            -6, -6,  0,  2, -9,  -9, -11,  -3,
-            -9,  2,  3, -1, -5, -13,   4, -20,
-        ]
-
-    MG_QUEEN_SQ_TABLE = [
-            -28,   0,  29,  12,  59,  44,  43,  45,
-            -24, -39,  -5,   1, -16,  57,  28,  54,
-            -13, -17,   7,   8,  29,  56,  47,  57,
-            -27, -27, -16, -16,  -1,  17,  -2,   1,
-             -9, -26,  -9, -10,  -2,  -4,   3,  -3,
-            -14,   2, -11,  -2,  -5,   2,  14,   5,
-            -35,  -8,  11,   2,   8,  15,  -3,   1,
-             -1, -18,  -9,  10, -15, -25, -31, -50,
-        ]
-
-    EG_QUEEN_SQ_TABLE = [
-             -9,  22,  22,  27,  27,  19,  10,  20,
-            -17,  20,  32,  41,  58,  25,  30,   0,
-            -20,   6,   9,  49,  47,  35,  19,   9,
-              3,  22,  24,  45,  57,  40,  57,  36,
-            -18,  28,  19,  47,  31,  34,  39,  23,
-            -16, -27,  15,   6,   9,  17,  10,   5,
-            -22, -23, -30, -16, -16, -23, -36, -32,
-            -33, -28, -22, -43,  -5, -32, -20, -41,
-        ]
-
-    MG_KING_SQ_TABLE = [
-            -65,  23,  16, -15, -56, -34,   2,  13,
-             29,  -1, -20,  -7,  -8,  -4, -38, -29,
-             -9,  24,   2, -16, -20,   6,  22, -22,
-            -17, -20, -12, -27, -30, -25, -14, -36,
-            -49,  -1, -27, -39, -46, -44, -33, -51,
-            -14, -14, -22, -46, -44, -30, -15, -27,
-              1,   7,  -8, -64, -43, -16,   9,   8,
-            -15,  36,  12, -54,   8, -28,  24,  14,
-        ]
-
-    EG_KING_SQ_TABLE = [
-            -74, -35, -18, -18, -11,  15,   4, -17,
-            -12,  17,  14,  17,  17,  38,  23,  11,
-             10,  17,  23,  15,  20,  45,  44,  13,
-             -8,  22,  24,  27,  26,  33,  26,   3,
-            -18,  -4,  21,  24,  27,  23,   9, -11,
-            -19,  -3,  11,  21,  23,  16,   7,  -9,
-            -27, -11,   4,  13,  14,   4,  -5, -17,
-            -53, -34, -21, -11, -28, -14, -24, -43
-        ]
-
     def __init__(self):
-        self._init_sq_tables()
         self._init_game_state()
         self.move_time_limit = self.MOVE_TIME_LIMIT
         self.depth_record = []
         self.time_record = []
-        if self.Z_HASHING:
-            self._make_move = self._make_move_z
-            self._unmake_move = self._unmake_move_z
-            self._init_z_table()
-        else:
-            self._make_move = self._make_move_default
-            self._unmake_move = self._unmake_move_default
+        self._make_move = self._make_move_default
+        self._unmake_move = self._unmake_move_default
 
     def __str__(self):
         return 'engine (depth %d)' % self.DEPTH
 
     __repr__ = __str__
 
-    def _init_sq_tables(self):
-        sq_tables = [var for var in dir(self) if var.endswith('SQ_TABLE')]
-        for table_name in sq_tables:
-            table = getattr(self, table_name)
-            w_table = [0] * 64
-            for sq in range(64): w_table[sq] = table[sq ^ 56]
-            b_table = table
-            combined = [b_table, w_table]
-            setattr(self, table_name, combined)
-
     def _init_game_state(self, board = None):
-        self.board = board if board else Board()
+        # search runs on a lean board, the game's chess.Board is only used for converting at the edges
+        self.game_board = board
+        self.board = EvalBoard()
+        if board is not None:
+            self.board.set_board(board)
         self.book = self.BOOK
         self.endgame = False
         self.resigned = False
         self.move_evals = []
-        self.top_moves = {}
         self.killers = []
-        self.counters = [[None]*64 for i in range(64)]
-        self.history = []
-        for i in range(2):
-            self.history.append([])
-            for j in range(64):
-                self.history[i].append([])
-                for k in range(64):
-                    self.history[i][j].append(0)
-        self.tp = {}
+        # counter moves and history are indexed by the from/to squares of a move (move & MOVE_SQUARES)
+        self.counters = [NULL_MOVE] * 4096
+        self.history = [[0] * 4096 for _ in range(2)]
+        self._init_tt()
         self.all_moves = 0
         self.used_moves = 0
         self.q_all_moves = 0
@@ -307,13 +143,10 @@ class Engine(object):
         self.move_hits = 0
         self.top_hits = 0
         self.nodes = 0
-        self.times = {
-                'ev': 0,
-                'evp': 0,
-                'evt': 0,
-                'q': 0,
-                'h':0,
-        }
+
+    def _init_tt(self):
+        # (a parallel search uses a shared table instead, see smp.py)
+        self.tt = TranspositionTable(self.TT_MB)
 
     def game_pgn(self, white = '', black = ''):
         import chess.pgn
@@ -326,13 +159,13 @@ class Engine(object):
         game.headers.pop('Site')
         game.headers.pop('Round')
         node = game
-        for m in self.board.move_stack:
+        for m in self.board.to_board().move_stack:
             node = node.add_variation(m)
         return str(game)
 
     def set_fen(self, fen):
         self._init_game_state()
-        self.board = Board(fen)
+        self.board.set_fen(fen)
 
     def average_depth(self):
         return sum(self.depth_record) / len(self.depth_record)
@@ -340,33 +173,46 @@ class Engine(object):
     def average_time(self):
         return sum(self.time_record) / len(self.time_record)
 
-    def play(self, player_color = chess.WHITE, board = None):
-        self.board = board if board else Board()
+    def play(self, player_color = chess.WHITE, board = None, stats_file = None):
+        # stats_file: instrument the eval, and write its stats (as json) there after each of our moves
+        self.board.set_board(board if board else Board())
         self.player_color = player_color
         self.color = not self.player_color
-        tt = 0
+        stats = None
+        if stats_file:
+            stats = instrument.EvalStats()
+            stats.enable()
+        moves = []
+        try:
+            self._play_game(player_color, stats, stats_file, moves)
+        finally:
+            if stats:
+                stats.disable()
+        print('Game over: %s' % self._game_result())
+        print(self.game_pgn(white = 'human' if player_color else 'engine', black = 'engine' if player_color else 'human'))
+
+    def _play_game(self, player_color, stats, stats_file, moves):
         while not self._is_game_over():
             if self.board.turn == player_color:
                 self._player_move()
             else:
                 t0 = time.time()
-                self._play_move()
+                move = self._play_move()
                 t = time.time() - t0
-                tt += t
                 print('took %.2fs' % t)
-                print('  breakdown:')
-                for x, dur in self.times.items():
-                    print('  - %s: %.2fs (%.1f%%)' % (x, dur, 100*dur/tt))
+                if stats:
+                    print(stats.report())
+                    # per move engine stats, with the term stats for the whole game so far
+                    moves.append(dict(move = move.uci(), time = t, **stats.engine_stats(self)))
+                    instrument.dump(stats_file, {'terms': stats.term_stats(), 'moves': moves})
                 if self.move_hits:
                     print('top move hits: %d, total: %d (%.1f%%)' % (self.top_hits, self.move_hits, 100*self.top_hits/self.move_hits))
                 if self.nodes:
                     print('total nodes evaluated: %d' % self.nodes)
             self._display_board()
-        print('Game over: %s' % self._game_result())
-        print(self.game_pgn(white = 'human' if player_color else 'engine', black = 'engine' if player_color else 'human'))
 
     def _is_game_over(self):
-        return self.board.is_game_over() or self.should_resign()
+        return self.board.to_board().is_game_over() or self.should_resign()
 
     def should_resign(self):
         if len(self.move_evals) < 5:
@@ -376,6 +222,8 @@ class Engine(object):
         #  - if eval has been low for several moves
         # TODO: maybe also in the endgame if we are down a rook or so or more.
         #       also if eval is low (but higher than threshold) for more moves.
+        # (called before play_move, so the opponent's last move - maybe a capture - isn't on our board yet)
+        self._sync_board()
         mat_diff = self._material_count(self.color) - self._material_count(not self.color)
         mat_cutoff = -self.PIECE_VALUES[chess.QUEEN]
         if mat_diff < mat_cutoff:
@@ -392,13 +240,14 @@ class Engine(object):
     def _game_result(self):
         if self.resigned:
             return '0-1 (white resigns)' if self.color else '1-0 (black resigns)'
-        return self.board.result()
+        return self.board.to_board().result()
 
     def _display_board(self):
+        board = self.board.to_board()
         if self.DISPLAY:
-            display(self.board)
-            print(self.board)
-        print(self.board.fen())
+            display(board)
+            print(board)
+        print(board.fen())
 
     def _log(self, msg):
         if self.LOG:
@@ -407,41 +256,70 @@ class Engine(object):
             print('%s %s' % (prefix, msg))
 
     def _player_move(self):
+        board = self.board.to_board()
         while True:
             try:
-                move = input('your move: ')
-                self.board.push_san(move)
+                san = input('your move: ')
+                self.board.push(self.board.encode_move(board.parse_san(san)))
                 break
             except ValueError:
-                print('illegal move: %s' % move)
+                print('illegal move: %s' % san)
 
     def start_game(self, board, color, move_time):
         self._init_game_state(board)
         self.move_time_limit = move_time
         self.color = color
 
+    def _sync_board(self):
+        if self.game_board is not None:
+            # pick up the moves played on the game board since our last move
+            self.board.set_board(self.game_board)
+
     def play_move(self):
+        self._sync_board()
         move = self._select_move()
         return move
 
     def _play_move(self):
         move = self._select_move()
-        self._make_move(move)
+        self._make_move(self.board.encode_move(move))
         return move
 
-    def _is_move_time_over(self):
-        return time.time() - self._move_start_time > self.move_time_limit
+    def _start_clock(self):
+        self._move_start_time = time.time()
+        self.hard_time_limit = self._move_start_time + self.move_time_limit
+        self.soft_time_limit = self._move_start_time + self.SOFT_TIME_RATIO * self.move_time_limit
+        self.time_over = False
+        self.next_time_check = self.nodes + self.TIME_CHECK_NODES
+
+    def _check_time(self):
+        # called by the search every TIME_CHECK_NODES nodes - once the hard limit is over, it unwinds
+        self.next_time_check = self.nodes + self.TIME_CHECK_NODES
+        if time.time() > self.hard_time_limit:
+            self.time_over = True
+
+    def _extend_time(self):
+        soft_time = (self.soft_time_limit - self._move_start_time) * self.TIME_EXTENSION
+        self.soft_time_limit = min(self._move_start_time + soft_time, self.hard_time_limit)
+
+    def _is_soft_time_over(self):
+        return time.time() > self.soft_time_limit
 
     def _select_move(self):
-        self._move_start_time = time.time()
+        self._start_clock()
+        self.tt.new_search()
         self._check_endgame()
         book_move = self._select_book_move()
         if book_move:
             return book_move
+        # scores of the root moves from the previous depth, for ordering them (see _search_root)
+        self.root_scores = {}
         if self.ITERATIVE:
             move, best_eval = self._iterative_deepening()
         else:
             move, best_eval  = self._search_root(depth = self.ENDGAME_DEPTH if self.endgame else self.DEPTH)
+        # search uses int moves, the selected move is returned as a chess.Move
+        move = decode_move(move)
         self.move_evals.append((move, best_eval))
         self.time_record.append(time.time() - self._move_start_time)
         return move
@@ -462,7 +340,7 @@ class Engine(object):
                 with chess.polyglot.open_reader(book_file) as reader:
                     # we use choice instead of weighted_choice for better uniformity in testing
                     # in real games we might want to use weighted_choice instead
-                    move = reader.choice(self.board).move
+                    move = reader.choice(self.board.to_board()).move
                     return move
             except IndexError:
                 continue
@@ -474,34 +352,70 @@ class Engine(object):
         best_move = None
         move_eval = -self.INF
         for depth in range(1, self.MAX_ITER_DEPTH + 1):
-            depth_best_move, depth_best_eval = self._search_root(depth = depth)
-            if depth_best_move is not None:
-                # may be None if timed out
-                best_move, move_eval = depth_best_move, depth_best_eval
-            if abs(move_eval) == self.MATE_SCORE or self._is_move_time_over():
+            if self._skip_depth(depth):
+                continue
+            # aspiration window around the previous depth's score - not on the first depth, or with a mate score
+            # (which isn't going to be within a small window of the next one)
+            if best_move is None or abs(move_eval) >= self.MATE_SCORE - self.MAX_ITER_DEPTH:
+                alpha_delta = beta_delta = self.INF
+            else:
+                alpha_delta = beta_delta = self.ASPIRATION_WINDOW
+            while True:
+                alpha = max(move_eval - alpha_delta, -self.INF)
+                beta = min(move_eval + beta_delta, self.INF)
+                depth_best_move, depth_best_eval = self._search_root(depth, alpha, beta)
+                if depth_best_move is None:
+                    # timed out before any move was searched
+                    break
+                if depth_best_eval <= alpha and alpha > -self.INF:
+                    # fail low: the score is only an upper bound, search again with a wider window below - this
+                    # may well change the best move, so take some more time for it
+                    alpha_delta *= self.ASPIRATION_WIDENING
+                    self._extend_time()
+                elif depth_best_eval >= beta and beta < self.INF:
+                    # fail high: this move is at least as good as the window's top, so keep it in case we run out
+                    # of time, and search again with a wider window above
+                    best_move, move_eval = depth_best_move, depth_best_eval
+                    beta_delta *= self.ASPIRATION_WIDENING
+                else:
+                    if best_move is not None and depth_best_move != best_move:
+                        # the best move changed - give the next depth more of a chance to settle it
+                        self._extend_time()
+                    best_move, move_eval = depth_best_move, depth_best_eval
+                    if not self.time_over:
+                        # (otherwise it's the best of the moves searched before time ran out)
+                        self._depth_done(depth, best_move, move_eval)
+                    break
+                if self.time_over:
+                    break
+            if abs(move_eval) == self.MATE_SCORE or self.time_over or self._is_soft_time_over():
                 break
         self.depth_record.append(depth)
 
         if best_move is None:
             # if we timed out before completely searching one root move then
             # see if there's a tt move, and if not just choose the best eval move
-            board_hash = self.board.get_hash()
-            if board_hash in self.top_moves:
-                best_move = self.top_moves[board_hash]
-            else:
+            best_move = self._tt_move()
+            if best_move is None or not self.board.is_legal(best_move):
                 best_move = max(self.board.legal_moves, key = self._move_sortkey)
         return best_move, move_eval
 
+    def _skip_depth(self, depth):
+        # (for the helpers of a parallel search, see smp.py)
+        return False
+
+    def _depth_done(self, depth, move, value):
+        # called with the result of each depth that was completely searched, within the window
+        pass
+
     def _check_endgame(self):
-        self.board.endgame = self.endgame
+        # NOTE: this only affects the search (depth, null move pruning etc.) - the evaluation is tapered by the
+        #       board's game phase and doesn't depend on it
         if not self.endgame:
             self.endgame = all(self._material_count(color) <= 1300 for color in chess.COLORS)
-            self.board.endgame = self.endgame
             if self.endgame:
                 pass
                 #print('--- ENDGAME HAS BEGUN ---')
-                # TODO: should use tapered eval for a gradual transition into endgame ... right now we may have
-                # 14 vs 5 material but does not count as endgame, and king stays put etc...
                 # NOTE: also may use a less strict endgame definition, stockfish e.g. calls endgame much earlier
                 # in this game: https://lichess.org/6bwh9VjF - in move 32, whereas I only called it in move 58
 
@@ -537,12 +451,20 @@ class Engine(object):
             moves.pop(max_m)
 
     def _sorted_moves(self):
-        return sorted(self.board.legal_moves, key = self._move_sortkey)
+        # pseudo-legal moves - legality is checked only for moves that are actually made
+        return sorted(self.board.pseudo_legal_moves, key = self._move_sortkey)
+
+    def _tt_move(self):
+        # the key check makes it unlikely that the entry is another position's, but not impossible (and more likely
+        # with a table shared between processes, see smp.py) - so the move is checked before it's played
+        move = self.tt.get_move(self.board.get_hash())
+        if move is not None and not self.board.is_pseudo_legal(move):
+            return None
+        return move
 
     def _gen_moves(self):
         self.move_hits += 1
-        board_hash = self.board.get_hash()
-        top_move = self.top_moves.get(board_hash)
+        top_move = self._tt_move()
         if top_move:
             self.top_hits += 1
             self.used_moves += 1
@@ -555,17 +477,16 @@ class Engine(object):
                 yield move
 
     def _move_sortkey(self, move):
-        if move.promotion:
+        if move & MOVE_PROMOTION:
             return -2 * self.PIECE_VALUES[QUEEN]
-        if self.board.is_capture(move):
+        if move & MOVE_CAPTURE:
             # use mvv/lva score for captures
-            victim = self.board.piece_type_at(move.to_square)
-            if victim is None:
-                # en passant
+            if move & MOVE_EP:
                 victim = PAWN
                 attacker = PAWN
             else:
-                attacker = self.board.piece_type_at(move.from_square)
+                victim = self.board.piece_type_at(move >> 6 & 63)
+                attacker = self.board.piece_type_at(move & 63)
             # use a large multiplication value to ensure good captures are sorted first
             # and bad captures later relative to quiet moves which use board evaluation
             return self.PIECE_VALUES[attacker] - (64 * self.PIECE_VALUES[victim])
@@ -574,19 +495,16 @@ class Engine(object):
             # but before quiet moves
             return -500
         hist_score = 0
-        if len(self.board.move_stack) > 0:
-            prev_move = self.board.move_stack[-1]
-            if move == self.counters[prev_move.from_square][prev_move.to_square]:
+        if self.board.move_stack:
+            if move == self.counters[self.board.move_stack[-1] & MOVE_SQUARES]:
                 hist_score -= 500
-        return hist_score - self.history[self.board.turn][move.from_square][move.to_square]
+        return hist_score - self.history[self.board.turn][move & MOVE_SQUARES]
 
     def is_checkmate(self):
         # we are in checkmate when we are in check and have no moves left
         # this is faster than board.is_checkmate because that tests for check twice
-        king = msb(self.board.kings & self.board.occupied_co[self.board.turn])
-        checkers = self.board.attackers_mask(not self.board.turn, king)
+        king, checkers, blockers = self.board._get_check_info()
         if checkers:
-            blockers = self.board._slider_blockers(king)
             for move in self.board._generate_evasions(king, checkers):
                 if self.board._is_safe(king, blockers, move):
                     return False
@@ -595,8 +513,8 @@ class Engine(object):
 
     def _sorted_q_moves(self):
         qs_moves = [
-            m for m in self.board.legal_moves
-            if (self.board.is_capture(m) and not self._skip_qs_move(m)) or m.promotion == QUEEN or self.board.gives_check(m)
+            m for m in self.board.pseudo_legal_moves
+            if (m & MOVE_CAPTURE and not self._skip_qs_move(m)) or m >> 12 & 7 == QUEEN or self.board.gives_check(m)
         ]
         return sorted(qs_moves, key = self._mvv_lva_sort)
 
@@ -612,32 +530,40 @@ class Engine(object):
         return self._is_losing_capture(move) and self._static_exchange_evaluation(move) < 0
 
     def _is_losing_capture(self, move):
-        victim = self.board.piece_type_at(move.to_square)
-        if victim is None:
+        if move & MOVE_EP:
+            return False
+        to_square = move >> 6 & 63
+        victim = self.board.piece_type_at(to_square)
+        attacker = self.board.piece_type_at(move & 63)
+        if self.PIECE_VALUES[attacker] <= self.PIECE_VALUES[victim]:
             return False
-        attacker = self.board.piece_type_at(move.from_square)
-        return self.PIECE_VALUES[attacker] > self.PIECE_VALUES[victim]
+        # taking an undefended piece is never losing (the attack maps are mostly cached from evaluating this position)
+        return bool(chess.BB_SQUARES[to_square] & self.board.attack_maps(not self.board.turn)[0])
 
     def _mvv_lva_sort(self, move):
-        if move.promotion:
-            return -8 * self.PIECE_VALUES[move.promotion]
-        if not self.board.is_capture(move):
+        if move & MOVE_PROMOTION:
+            return -8 * self.PIECE_VALUES[move >> 12 & 7]
+        if not move & MOVE_CAPTURE:
             # check move
             return 0
-        victim = self.board.piece_type_at(move.to_square)
-        if victim is None:
-            # en passant
+        if move & MOVE_EP:
             victim = PAWN
             attacker = PAWN
         else:
-            attacker = self.board.piece_type_at(move.from_square)
+            victim = self.board.piece_type_at(move >> 6 & 63)
+            attacker = self.board.piece_type_at(move & 63)
         # the following is supposed to be better than a simple subtraction, the idea being
         # that we sort by most valuable victim first, and by least vaulable attacker second
         # - it does seem to be a bit faster in tests
         # see: http://talkchess.com/forum3/viewtopic.php?t=30135#p296386
         return self.PIECE_VALUES[attacker] - (16 * self.PIECE_VALUES[victim])
 
-    def _quiesce(self, alpha, beta): # TODO: also figure out how to time-limit
+    def _quiesce(self, alpha, beta):
+
+        if self.nodes >= self.next_time_check:
+            self._check_time()
+        if self.time_over:
+            return alpha
 
         # NOTE: If I'm in check, it's not a quiet position - so it needs to be resolved before
         #       evaluating. So we might test if check and if so go another depth level.
@@ -647,10 +573,9 @@ class Engine(object):
         # probe tt: increases speed somewhat - in most cases just a bit
         orig_alpha = alpha
         board_hash = self.board.get_hash()
-        entry = self.tp.get(board_hash)
+        entry = self.tt.probe(board_hash)
         if entry:
-            val = entry.val
-            entry_type = entry.type
+            val, entry_type, _, _ = entry
             # TODO: alpha<val<beta may not be needed - it was said in talkchess in response
             # to that zensomething user who posted her code
             # idea was that if it's exact then val is going to be between alpha and beta anyway
@@ -674,14 +599,13 @@ class Engine(object):
         if self.is_checkmate():
             stand_pat = -self.MATE_SCORE
         else:
-            stand_pat = self.board.evaluate()
+            stand_pat = self.board.evaluate(alpha, beta)
         # TODO: test with a margin here instead, e.g., maybe cutoff if we're at 198 and beta is 200... could 
         # speed things up without real loss, and the speed might be worth it
         if stand_pat >= beta:
             # beta cutoff: the evaluated position is 'too good', because the opponent already has a way to avoid this
             # with a position for which there is this beta score, so there's no point in searching further down this road.
-            entry = Entry(beta, LOWER, 0)
-            self.tp[board_hash] = entry
+            self.tt.store(board_hash, None, beta, LOWER, 0)
             return beta
 
         # delta pruning
@@ -703,28 +627,33 @@ class Engine(object):
             alpha = stand_pat
 
         score = -self.INF
+        best_move = None
         for move in self._gen_quiesce_moves():
 
             # move delta pruning
-            if not move.promotion:
-                capture_type = self.board.piece_type_at(move.to_square)
+            if not move & MOVE_PROMOTION:
+                capture_type = self.board.piece_type_at(move >> 6 & 63)
                 # we use a delta of 20 as was found to be best in testing
                 if capture_type and (self.PIECE_VALUES[capture_type] + stand_pat + 20 < alpha):
                     # this move can't raise alpha
                     continue
 
+            if not self.board.is_legal(move):
+                continue
+
             piece_from, piece_to = self._make_move(move)
             score = -self._quiesce(-beta, -alpha)
             self._unmake_move(move, piece_from, piece_to)
+            if self.time_over:
+                # aborted - nothing found below can be trusted, or stored
+                return alpha
             if score >= beta:
-                self.top_moves[self.board.get_hash()] = move
-                entry = Entry(beta, LOWER, 0)
-                self.tp[board_hash] = entry
+                self.tt.store(board_hash, move, beta, LOWER, 0)
                 return beta
             if score > alpha:
                 alpha = score
                 # not fully sure that this is sound, since in QS we're not searching all moves
-                self.top_moves[self.board.get_hash()] = move
+                best_move = move
 
         # TODO: FIXME: this condition should be removed - this is probably the same thing as in 
         #              negamax that i fixed - gotta store alpha/beta not score if not exact
@@ -736,66 +665,95 @@ class Engine(object):
                 entry_type = LOWER
             else:
                 entry_type = EXACT
-            self.tp[board_hash] = Entry(score, entry_type, 0)
+            self.tt.store(board_hash, best_move, score, entry_type, 0)
 
         return alpha
 
-    def _search_root(self, depth):
+    def _root_moves(self):
+        # moves that had a score in the previous depth go first, best first - the rest (which failed low there)
+        # are in the usual move order, which has better information on them (the history etc.) than their bounds
+        moves = [move for move in self._gen_moves() if self.board.is_legal(move)]
+        if self.root_scores:
+            root_scores = self.root_scores
+            moves.sort(key = lambda move: -root_scores.get(move, -self.INF))
+        return moves
+
+    def _new_iteration(self):
+        # move ordering state is reset for each root search, except the history, which is only aged
+        self.killers = [NULL_MOVE] * (self.MAX_ITER_DEPTH + 1)
+        self.counters = [NULL_MOVE] * 4096
+        self.history = [[h / 2 for h in side_history] for side_history in self.history]
+        self.ply = 0
+
+    def _search_root(self, depth, alpha = None, beta = None):
 
-        self.killers = [None] * (self.MAX_ITER_DEPTH + 1)
-        self.counters = [[None]*64 for i in range(64)]
-        for side in range(2):
-            for sfrom in range(64):
-                for sto in range(64):
-                    self.history[side][sfrom][sto] /= 2
+        self._new_iteration()
 
         t0 = time.time()
-        self.time_over = False
-        self.ply = 0
 
         board_hash = self.board.get_hash()
         best_move = None
         best_value = -self.INF
-        alpha = -self.INF
-        beta = self.INF
+        if alpha is None:
+            alpha = -self.INF
+        if beta is None:
+            beta = self.INF
+        orig_alpha = alpha
         move_values = {}
+        # moves that raised alpha - the only ones that have an actual score, rather than just a bound
+        scores = {}
 
         prev_nodes = self.nodes
 
-        for move in self._gen_moves():
+        for move in self._root_moves():
             t1 = time.time()
             if self.PRINT:
-                print('evaluating move %s' % self.board.san(move))
+                print('evaluating move %s' % self.board.san(decode_move(move)))
             piece_from, piece_to = self._make_move(move)
-            value =  -self._negamax(depth - 1, 0, -beta, -alpha)
+            null_value = None
+            if best_move is None:
+                value = -self._negamax(depth - 1, 0, -beta, -alpha)
+            else:
+                # principal variation search: the first move is expected to be the best, so the rest only need to
+                # be shown to be worse with a null window - and are searched again if they aren't
+                value = -self._negamax(depth - 1, 0, -alpha - 1, -alpha)
+                if alpha < value < beta and not self.time_over:
+                    null_value = value
+                    value = -self._negamax(depth - 1, 0, -beta, -alpha)
             self._unmake_move(move, piece_from, piece_to)
             if self.time_over:
+                if null_value is not None:
+                    # out of time while searching it again, but the null window did show that this move is better
+                    # than the best one so far - by at least a bit
+                    best_move, best_value = move, null_value
+                    move_values[move] = null_value
                 break
             move_values[move] = value
             if value > best_value:
                 best_value = value
                 best_move = move
-                self.top_moves[board_hash] = best_move
+                if value > orig_alpha:
+                    # the root's value is at least that of its best move so far
+                    self.tt.store(board_hash, best_move, best_value, LOWER, depth)
             if value > alpha:
                 alpha = value
+                scores[move] = value
+                if alpha >= beta:
+                    # fail high (only with an aspiration window)
+                    break
 
             if self.PRINT:
                 print('... %d nodes evaluated (%.4fs)' % (self.nodes - prev_nodes, time.time()-t1))
             prev_nodes = self.nodes
 
-            self._table_maintenance()
-            # consider terminating due to time
-            # - note that the time limit is not exact because we are checking it only after a best move,
-            #   which may occur after a long q search.
-            # - it should be possible to check time limit at qs/negamax levels as well, and store best_move internally
-            #   to return it at the end instead of some dummy eval.
-            if self._is_move_time_over():
-                break
+        # (if all moves failed low, the previous depth's order is kept)
+        if scores:
+            self.root_scores = scores
 
         if self.PRINT:
             print('evals (depth = %s)' % depth)
             for move, val in move_values.items():
-                print('%s: %.2f' % (self.board.san(move), val/100))
+                print('%s: %.2f' % (self.board.san(decode_move(move)), val/100))
         else:
             pass
             #print('best eval: %.2f (depth = %s)' % (move_values[best_move]/100, depth))
@@ -805,32 +763,34 @@ class Engine(object):
 
     def _gen_checks(self): 
         self.move_hits += 1
-        top_move = self.top_moves.get(self.board.get_hash())
+        top_move = self._tt_move()
         if top_move:
             self.top_hits += 1
             yield top_move
         # only checks and promotions - no move ordering as there should be only a few moves
-        for move in self.board.legal_moves:
-            if move != top_move or move.promotion == QUEEN or self.board.gives_check(move):
+        for move in self.board.pseudo_legal_moves:
+            if move != top_move or move >> 12 & 7 == QUEEN or self.board.gives_check(move):
                 yield move
 
     def _negamax(self, depth, ply, alpha, beta, can_null = True):
 
-        if self._is_move_time_over():
-            self.time_over = True
+        if self.nodes >= self.next_time_check:
+            self._check_time()
+        if self.time_over:
             return alpha
 
         self.ply = ply
 
+        # repetitions inside the search tree are draws right away - no point searching cycles
+        # (ply + 1 as ply is 0 right after the root move)
+        if self.board.is_search_draw(ply + 1):
+            return 0
+
         orig_alpha = alpha
         board_hash = self.board.get_hash()
-        entry = self.tp.get(board_hash)
-        if entry and entry.depth >= depth:
-            if self.board.is_repetition(count = 3):
-                self.tp.pop(board_hash)
-                return 0
-            val = entry.val
-            entry_type = entry.type
+        entry = self.tt.probe(board_hash)
+        if entry and entry[2] >= depth:
+            val, entry_type, _, _ = entry
             if entry_type == EXACT:
                 return val
             if entry_type == LOWER:
@@ -839,11 +799,13 @@ class Engine(object):
             else: # UPPER
                 beta = min(beta, val)
             if alpha >= beta:
-                move = self.board.move_stack[-1]
-                prev_move = self.board.move_stack[-2]
-                self.killers[ply] = move
-                self.counters[prev_move.from_square][prev_move.to_square] = move
-                self.history[self.board.turn][move.from_square][move.to_square] += depth*depth
+                move_stack = self.board.move_stack
+                move = move_stack[-1]
+                self.killers[ply] = move & KILLER_MASK
+                # (a root position set up from a fen has no move before it)
+                if len(move_stack) > 1:
+                    self.counters[move_stack[-2] & MOVE_SQUARES] = move & KILLER_MASK
+                self.history[self.board.turn][move & MOVE_SQUARES] += depth*depth
                 return val
 
         if depth == 0:
@@ -851,6 +813,7 @@ class Engine(object):
 
         value = -self.INF
         best_value = -self.INF
+        best_move = None
 
         # null move pruning
         if can_null and depth > 2 and beta < self.INF and not self.endgame and not self.board.is_check():
@@ -865,49 +828,60 @@ class Engine(object):
         gen_moves = self._gen_moves
         if depth < 4:
             max_pos_gain = 120 * depth
-            e = self.board.evaluate()
+            # (only the comparison with alpha - max_pos_gain matters, so that's the window for lazy evaluation)
+            e = self.board.evaluate(alpha - max_pos_gain - 1, alpha - max_pos_gain)
             if e + max_pos_gain < alpha:
                 gen_moves = self._gen_quiesce_moves
                 if e + self._max_opponent_piece_value() + max_pos_gain < alpha:
                     gen_moves = self._gen_checks
 
+        # moves are pseudo-legal, so only legal moves actually made are counted
         move_count = 0
         for move in gen_moves():
+            if not self.board.is_legal(move):
+                continue
             move_count += 1
 
             self.ply = ply
 
             # late move reduction - params are not optimized but this works well
-            if move_count >= 4 and depth >= 3 and move != self.killers[ply] and not move.promotion and not self.board.is_capture(move) and not self.board.is_check() and not self.board.gives_check(move):
+            if move_count >= 4 and depth >= 3 and move != self.killers[ply] and not move & (MOVE_PROMOTION | MOVE_CAPTURE) and not self.board.is_check() and not self.board.gives_check(move):
                 R = 2
                 if move_count >= 10 and depth >= 4:
                     R = 3
 
                 piece_from, piece_to = self._make_move(move)
-                # reduce depth by R instead of 1
-                value = -self._negamax(depth - R, ply + 1, -beta, -alpha)
+                # reduce depth by R instead of 1, with a null window
+                value = -self._negamax(depth - R, ply + 1, -alpha - 1, -alpha)
                 if value > alpha:
                     # alpha is raised - do full-depth search
-                    value = -self._negamax(depth - 1, ply + 1, -beta, -alpha)
+                    value = self._pv_search(depth, ply, alpha, beta)
+            elif move_count > 1:
+                piece_from, piece_to = self._make_move(move)
+                value = self._pv_search(depth, ply, alpha, beta)
             else:
                 piece_from, piece_to = self._make_move(move)
                 value = -self._negamax(depth - 1, ply + 1, -beta, -alpha)
 
             self._unmake_move(move, piece_from, piece_to)
+            if self.time_over:
+                return alpha
             if value > best_value:
                 best_value = value
                 if value > alpha:
-                    self.top_moves[board_hash] = move
+                    best_move = move
                     alpha = value
                     if alpha >= beta:
                         # fail high: position is too good - opponent has an already searched way to avoid it.
                         prev_move = self.board.move_stack[-1]
-                        self.killers[ply] = move
-                        self.counters[prev_move.from_square][prev_move.to_square] = move
-                        self.history[self.board.turn][move.from_square][move.to_square] += depth*depth
+                        self.killers[ply] = move & KILLER_MASK
+                        self.counters[prev_move & MOVE_SQUARES] = move & KILLER_MASK
+                        self.history[self.board.turn][move & MOVE_SQUARES] += depth*depth
                         break
 
-        if move_count == 0 and not any(self.board.legal_moves):
+        # no legal moves were made: if all moves were generated this is checkmate or stalemate, otherwise
+        # (futility pruned generation) there may still be legal moves that weren't generated
+        if move_count == 0 and (gen_moves == self._gen_moves or not any(self.board.legal_moves)):
             # checkmate or stalemate
             if self.board.is_check():
                 value = alpha = -self.MATE_SCORE
@@ -926,22 +900,32 @@ class Engine(object):
             else:
                 # remember exact value higher than alpha but still lower than beta
                 entry_type = EXACT
-            self.tp[board_hash] = Entry(value, entry_type, depth)
+            self.tt.store(board_hash, best_move, value, entry_type, depth)
 
         return alpha
 
+    def _pv_search(self, depth, ply, alpha, beta):
+        # principal variation search of a move that was just made, other than the first: the first move is
+        # expected to be the best, so this one is only searched with a null window, to show that it's worse - and
+        # again with the full window if it isn't
+        value = -self._negamax(depth - 1, ply + 1, -alpha - 1, -alpha)
+        if alpha < value < beta:
+            value = -self._negamax(depth - 1, ply + 1, -beta, -alpha)
+        return value
+
     def _static_exchange_evaluation(self, move):
-        target = self.board.piece_type_at(move.to_square)
-        if not target:
-            # en passant
+        if move & MOVE_EP:
             return 0
-        attacker = self.board.piece_type_at(move.from_square)
+        from_square = move & 63
+        to_square = move >> 6 & 63
+        target = self.board.piece_type_at(to_square)
+        attacker = self.board.piece_type_at(from_square)
         gain = []
         d = 0
         mayxray = self.board.bishops | self.board.rooks | self.board.queens
-        fromset = 1 << move.from_square
+        fromset = 1 << from_square
         occ = self.board.occupied
-        attadef = self._attackers_mask(move.to_square)
+        attadef = self._attackers_mask(to_square)
         gain.append(self.PIECE_VALUES[target])
         while 1:
             d += 1
@@ -951,7 +935,7 @@ class Engine(object):
             attadef ^= fromset # remove current attacker from att&def mask
             occ ^= fromset
             if fromset & mayxray:
-                attadef |= self._attackers_xray(move.to_square, occ)
+                attadef |= self._attackers_xray(to_square, occ)
             # get least valuable attacker
             fromset, attacker = self._least_valuable_attacker(attadef, not (self.board.occupied_co[1] & fromset))
             if not fromset:
@@ -964,18 +948,15 @@ class Engine(object):
 
     def _attackers_mask(self, square):
         # returns attackers of both colors of the given square
-        rank_pieces = BB_RANK_MASKS[square] & self.board.occupied
-        file_pieces = BB_FILE_MASKS[square] & self.board.occupied
-        diag_pieces = BB_DIAG_MASKS[square] & self.board.occupied
-
+        occupied = self.board.occupied
         queens_and_rooks = self.board.queens | self.board.rooks
         queens_and_bishops = self.board.queens | self.board.bishops
 
         attackers = (
             (BB_KING_ATTACKS[square] & self.board.kings) |
             (BB_KNIGHT_ATTACKS[square] & self.board.knights) |
-            ((BB_RANK_ATTACKS[square][rank_pieces] | BB_FILE_ATTACKS[square][file_pieces]) & queens_and_rooks) |
-            (BB_DIAG_ATTACKS[square][diag_pieces] & queens_and_bishops) |
+            (BB_ROOK_ATTACKS[square][BB_ROOK_MASKS[square] & occupied] & queens_and_rooks) |
+            (BB_BISHOP_ATTACKS[square][BB_BISHOP_MASKS[square] & occupied] & queens_and_bishops) |
             (BB_PAWN_ATTACKS[True][square] & self.board.pawns & self.board.occupied_co[False]) |
             (BB_PAWN_ATTACKS[False][square] & self.board.pawns & self.board.occupied_co[True]))
 
@@ -1004,10 +985,6 @@ class Engine(object):
         return 0, None
 
     def _attackers_xray(self, square, occupied):
-        rank_pieces = BB_RANK_MASKS[square] & occupied
-        file_pieces = BB_FILE_MASKS[square] & occupied
-        diag_pieces = BB_DIAG_MASKS[square] & occupied
-
         rooks = self.board.rooks & occupied
         bishops = self.board.bishops & occupied
         queens = self.board.queens & occupied
@@ -1016,32 +993,13 @@ class Engine(object):
         queens_and_bishops = queens | bishops
 
         attackers = (
-            ((BB_RANK_ATTACKS[square][rank_pieces] | BB_FILE_ATTACKS[square][file_pieces]) & queens_and_rooks) |
-            (BB_DIAG_ATTACKS[square][diag_pieces] & queens_and_bishops))
+            (BB_ROOK_ATTACKS[square][BB_ROOK_MASKS[square] & occupied] & queens_and_rooks) |
+            (BB_BISHOP_ATTACKS[square][BB_BISHOP_MASKS[square] & occupied] & queens_and_bishops))
 
         return attackers
 
-    def _table_maintenance(self):
-        self.board.table_maintenance()
-        limits = {
-            'tp': self.TT_SIZE,
-            'top_moves': self.TT_SIZE /2,
-        }
-        for var, limit in limits.items():
-            table = getattr(self, var)
-            if len(table) > limit:
-                table.clear()
-
-    def _king_attacked_eval(self, king_sq, color):
-        # NOTE: This is too slow - takes more than entire piece_eval function
-        #       Instead, I should calculate attack by enemy piece type - bishops, knights, etc.,
-        #       and store hash for each piece types and relevant information - and see what is the
-        #       hit rate for such a hash and how fast it is.
-        #       - See _bishop_attackers_mask below for a start.
-        val = 0
-        for sq in self.KING_SURROUNDING_SQUARES[king_sq]:
-            val -= self._bb_count(self.board.attackers_mask(not color, sq)) * 15
-        return val
+    def hash_tables(self):
+        return [self.tt] + self.board.hash_tables()
 
     def _material_count(self, color):
         o = self.board.occupied_co[color]
@@ -1075,11 +1033,6 @@ class Engine(object):
             return self.PIECE_VALUES[KNIGHT]
         return self.PIECE_VALUES[PAWN]
 
-    def _is_hanging(self, color, piece):
-        attackers = self.board.attackers(not color, piece)
-        defenders = self.board.attackers(color, piece)
-        return len(attackers) > len(defenders) or len(defenders) == 0
-
     def _bb_count(self, x):
         x = (x & 0x5555555555555555) + ((x >> 1) & 0x5555555555555555)
         x = (x & 0x3333333333333333) + ((x >> 2) & 0x3333333333333333)
@@ -1088,102 +1041,21 @@ class Engine(object):
         x = (x & 0x0000FFFF0000FFFF) + ((x >> 16) & 0x0000FFFF0000FFFF)
         return (x & 0x00000000FFFFFFFF) + ((x >> 32) & 0x00000000FFFFFFFF)
 
-    # HASHING FUNCTIONS
-
-    def _piece_code(self, piece_type, color):
-        return piece_type + 6 * color - 1
-
-    def _init_z_table(self):
-        # a table for Zobrist Hashing
-
-        self.z_table = []
-        bit_length = 64 # note: 128 bit keys seem as fast, with less collision, but take more memory
-        rand_bitstring = lambda: random.randint(0, 2**bit_length-1)
-
-        # add codes for each of 64 squares
-        for sq in range(64):
-            self.z_table.append([])
-            # add code for each of 12 piece types
-            for _ in range(12):
-                self.z_table[sq].append(rand_bitstring())
-
-        # used for turn codes
-        self.z_black_turn = rand_bitstring()
-
-        # TODO: add 4 codes for castling rights, and 8 codes for en passant files
-
-    def _board_hash(self):
-        h = 0
-        for sq in range(64):
-            p = self.board.piece_at(sq)
-            if p:
-                piece_code = self._piece_code(p.piece_type, p.color)
-                h ^= self.z_table[sq][piece_code]
-        if not self.board.turn:
-            h ^= self.z_black_turn
-        return h
-
     def _make_move_default(self, move):
         self.nodes += 1
         self.board.push(move)
         return None, None
 
-    def _make_move_z(self, move): # promotion, castling and en passant should have special treatment!!!
-        piece_from = self.board.piece_at(move.from_square)
-        piece_to = self.board.piece_at(move.to_square)
-        self._apply_move(move, piece_from, piece_to)
-        self.board.push(move)
-        return piece_from, piece_to
-
     def _unmake_move_default(self, move, piece_from, piece_to):
         return self.board.pop()
 
-    def _unmake_move_z(self, move, piece_from, piece_to):
-        self.board.pop()
-        self._apply_move(move, piece_from, piece_to)
-
-    def _apply_move(self, move, piece_from, piece_to):
-        # apply move to board hash - called *before* move is pushed
-
-        # TODO: Need to handle en passant as well
-
-        # switch turn (code is alternately added/removed)
-        self._hash ^= self.z_black_turn
-
-        # remove the moving piece from original square
-        moving_piece_code = self._piece_code(piece_from.piece_type, piece_from.color)
-        self._hash ^= self.z_table[move.from_square][moving_piece_code]
-
-        # handle castling
-        if self.board.is_castling(move):
-            # add king to new square
-            self._hash ^= self.z_table[move.to_square][moving_piece_code]
-            rook_code = self._piece_code(chess.ROOK, piece_from.color)
-            rook_from_square, rook_to_square = self.ROOK_CASTLING_SQ[move.to_square]
-            # remove rook from original square and add to new square
-            self._hash ^= self.z_table[rook_from_square][rook_code] ^ self.z_table[rook_to_square][rook_code]
-            return
-
-        # if promotion, moving piece changes type
-        if move.promotion:
-            moving_piece_code = self._piece_code(move.promotion, piece_from.color)
-
-        # handle capture
-        if piece_to:
-            # remove captured piece
-            removed_piece_code = self._piece_code(piece_to.piece_type, piece_to.color)
-            self._hash ^= self.z_table[move.to_square][removed_piece_code]
-
-        # add moving piece to new square
-        self._hash ^= self.z_table[move.to_square][moving_piece_code]
-
-
     def _memory_size(self):
         # get memory size in MB of saved data - works only in python3, not in pypy3
         from sys import getsizeof
         size = 0
-        for struct in (self.tp, self.top_moves):
-            size += getsizeof(struct)
-            size += sum(map(getsizeof, struct.values())) + sum(map(getsizeof, struct.keys()))
+        for table in self.hash_tables():
+            size += getsizeof(table.keys) + getsizeof(table.values)
+            if not table.int_values:
+                size += sum(getsizeof(x) for x in table.values if x is not None)
         return size / 1024 / 1024
 
@@ -1,9 +1,13 @@
 import chess
 
-from board import Board
+from attacks import BB_ROOK_MASKS, BB_ROOK_ATTACKS, BB_BISHOP_MASKS, BB_BISHOP_ATTACKS
+from board import SearchBoard, MOVE_CASTLING, Z_PIECES
+from hashtable import HashTable
+import king_safety
 from square_tables import *
 
 msb = chess.msb
+popcount = chess.popcount
 scan_forward = chess.scan_forward
 square_rank = chess.square_rank
 
@@ -18,6 +22,12 @@ QUEEN = chess.QUEEN
 KING = chess.KING
 
 BB_FILES = chess.BB_FILES
+BB_PAWN_ATTACKS = chess.BB_PAWN_ATTACKS
+BB_KNIGHT_ATTACKS = chess.BB_KNIGHT_ATTACKS
+BB_KING_ATTACKS = chess.BB_KING_ATTACKS
+BB_ALL = chess.BB_ALL
+BB_NOT_FILE_A = ~chess.BB_FILE_A & BB_ALL
+BB_NOT_FILE_H = ~chess.BB_FILE_H & BB_ALL
 
 PIECE_VALUES = [-1, 100, 320, 330, 500, 900, 20000] # none, pawn, knight, bishop, rook, queen, king - list for efficiency
 KING_SHELTER_SQUARES = [(56,57,58,62,63),(0,1,2,6,7)]
@@ -89,38 +99,210 @@ def init_pawn_stoppers():
 
 PAWN_STOPPERS = init_pawn_stoppers()
 
-class EvalBoard(Board):
-
-    HASH_SIZE = 4e6
+def init_pawn_support_masks():
+    # squares on the adjacent files of a pawn, by [color][square]: where a friendly pawn can be to defend it, or
+    # advance to defend it (i.e. the same rank and behind) - a pawn that has none of those and can't safely advance
+    # is backward
+    support_masks = [[0] * 64, [0] * 64]
+    for sq in range(64):
+        rank = chess.square_rank(sq)
+        adjacent_files = ADJACENT_FILES[chess.square_file(sq)]
+        for other in range(64):
+            if adjacent_files & chess.BB_SQUARES[other]:
+                if chess.square_rank(other) <= rank:
+                    support_masks[WHITE][sq] |= chess.BB_SQUARES[other]
+                if chess.square_rank(other) >= rank:
+                    support_masks[BLACK][sq] |= chess.BB_SQUARES[other]
+    return support_masks
+
+ADJACENT_FILES = [(BB_FILES[f-1] if f > 0 else 0) | (BB_FILES[f+1] if f < 7 else 0) for f in range(8)]
+PAWN_SUPPORT_MASKS = init_pawn_support_masks()
+
+# TAPERED EVALUATION
+# scores are kept as packed (mg, eg) pairs in a single int, so that they can be added and subtracted as one and
+# cached independently of the game phase - the final evaluation interpolates between the two by the phase, which
+# goes from MAX_PHASE with all pieces on the board down to 0 with only pawns and kings
+#
+# NOTE: the mg value is in the low 16 bits, so it has to be within +-32767 - which any sum of scores here is
+
+PHASE_WEIGHTS = [0, 0, 1, 1, 2, 4, 0] # none, pawn, knight, bishop, rook, queen, king
+MAX_PHASE = 24
+ENDGAME_PHASE = 6
+
+def make_score(mg, eg):
+    return (eg << 16) + mg
+
+def eg_value(score):
+    return (score + 0x8000) >> 16
+
+def mg_value(score):
+    return score - (eg_value(score) << 16)
+
+def taper(score, phase):
+    # promotions can take the phase past the max
+    if phase > MAX_PHASE:
+        phase = MAX_PHASE
+    return (mg_value(score) * phase + eg_value(score) * (MAX_PHASE - phase)) // MAX_PHASE
+
+def init_piece_square_values():
+    # packed material + piece square table value of each piece on each square, by [color][piece type][square] and
+    # from white's perspective (i.e. negated for black) - these are the static parts of the evaluation, which the
+    # board keeps updated incrementally as pieces move (see EvalBoard.push)
+    # NOTE: a single flat list (indexed by piece, color and square) was tried, but the index arithmetic is slower
+    #       than the extra subscript in python. building this takes well under a millisecond, so it's not cached.
+    names = [None, 'PAWN', 'KNIGHT', 'BISHOP', 'ROOK', 'QUEEN', 'KING']
+    values = [[None] * 7, [None] * 7]
+    for color in (BLACK, WHITE):
+        sign = (-1,1)[color]
+        for piece_type in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+            mg_table = globals()['MG_%s_SQ_TABLE' % names[piece_type]][color]
+            eg_table = globals()['EG_%s_SQ_TABLE' % names[piece_type]][color]
+            piece_values = []
+            for sq in range(64):
+                value = 0
+                if piece_type == KNIGHT:
+                    value += KNIGHT_ATTACK_TABLE[sq] * SQUARE_VALUE
+                if piece_type != KING:
+                    value += PIECE_VALUES[piece_type]
+                piece_values.append(sign * make_score(value + mg_table[sq], value + eg_table[sq]))
+            values[color][piece_type] = piece_values
+    return values
+
+PIECE_SQUARE_VALUES = init_piece_square_values()
+
+DOUBLED_PAWN_SCORE = make_score(-15, -15)
+ISOLATED_PAWN_SCORE = make_score(-10, -20)
+BACKWARD_PAWN_SCORE = make_score(-8, -12)
+BISHOP_PAIR_SCORE = make_score(50, 50)
+MOBILITY_SCORE = make_score(SQUARE_VALUE, SQUARE_VALUE)
+KING_ZONE_ATTACK_SCORE = make_score(10, 0) # for each attack of a piece on a square next to the enemy king
+
+class EvalBoard(SearchBoard):
+
+    __slots__ = ('evals', 'pawn_hash', 'attack_hash', 'score', 'phase', 'pawn_key', '_score_stack', 'full_evals', 'lazy_exits')
+
+    HASH_SIZE = 2**20 # entries in the evals table, the others are smaller
+    # lazy evaluation: how far outside of the (alpha, beta) window the cheap part of the evaluation has to be for
+    # the rest to be skipped - i.e. by how much we assume the piece terms (mobility etc.) can't change the result
+    LAZY_MARGIN = 300
+    # the king safety stats (see king_safety.py) - only if the table has been compiled
+    KING_SAFETY = king_safety.available()
 
     def __init__(self, *arg, **kw):
         super().__init__(*arg, **kw)
-        self.endgame = False
-        self.evals = {}
-        self.p_hash = [[{},{}],[{},{}]]
-        self.pp_hash = [[{},{}],[{},{}]]
-        self.n_hash = [[{},{}],[{},{}]]
-        self.r_hash = [[{},{}],[{},{}]]
-        self.b_hash = [[{},{}],[{},{}]]
-        self.q_hash = [[{},{}],[{},{}]]
-        self.kp_hash = {} # TODO: change to be like the other ones
-
-    def evaluate(self):
+        self.evals = HashTable(self.HASH_SIZE, 'evals')
+        self.pawn_hash = HashTable(self.HASH_SIZE/16, 'pawn_hash', int_values = False)
+        self.attack_hash = HashTable(self.HASH_SIZE/4, 'attack_hash', int_values = False)
+        self.full_evals = 0
+        self.lazy_exits = 0
+
+    def hash_tables(self):
+        return [self.evals, self.pawn_hash, self.attack_hash]
+
+    def set_board(self, board):
+        # the score, phase and pawn key have to be set up for the root position before its move history is pushed
+        super().set_board(board.root())
+        self._score_stack = []
+        self.score, self.phase = self.static_score()
+        self.pawn_key = self.pawn_zobrist_key()
+        for move in board.move_stack:
+            self.push(self.encode_move(move))
+
+    def static_score(self):
+        """ packed material + piece square score from scratch, from white's perspective, and the game phase """
+        score = phase = 0
+        for color in (BLACK, WHITE):
+            for piece_type, pieces in enumerate((self.pawns, self.knights, self.bishops, self.rooks,
+                                                 self.queens, self.kings), 1):
+                for sq in scan_forward(pieces & self.occupied_co[color]):
+                    score += PIECE_SQUARE_VALUES[color][piece_type][sq]
+                    phase += PHASE_WEIGHTS[piece_type]
+        return score, phase
+
+    def pawn_zobrist_key(self):
+        """ zobrist key of the pawns of both colors, from scratch """
+        key = 0
+        for color in (BLACK, WHITE):
+            for sq in scan_forward(self.pawns & self.occupied_co[color]):
+                key ^= Z_PIECES[color][PAWN][sq]
+        return key
+
+    def push(self, move):
+        # the score, phase and pawn key are updated by what the move changed, and just restored on pop
+        self._score_stack.append((self.score, self.phase, self.pawn_key))
+        super().push(move)
+        if not move:
+            return
+        color = not self.turn
+        values = PIECE_SQUARE_VALUES[color]
+        from_square = move & 63
+        to_square = move >> 6 & 63
+        if move & MOVE_CASTLING:
+            if to_square > from_square:
+                rook_square = to_square + 1
+                rook_to_square = to_square - 1
+            else:
+                rook_square = to_square - 2
+                rook_to_square = to_square + 1
+            self.score += (values[KING][to_square] - values[KING][from_square] +
+                           values[ROOK][rook_to_square] - values[ROOK][rook_square])
+            return
+        piece_type, captured_piece_type, capture_square = self._stack[-1][:3]
+        promotion = move >> 12 & 7
+        if promotion:
+            self.score += values[promotion][to_square] - values[PAWN][from_square]
+            self.phase += PHASE_WEIGHTS[promotion]
+            self.pawn_key ^= Z_PIECES[color][PAWN][from_square]
+        else:
+            self.score += values[piece_type][to_square] - values[piece_type][from_square]
+            if piece_type == PAWN:
+                self.pawn_key ^= Z_PIECES[color][PAWN][from_square] ^ Z_PIECES[color][PAWN][to_square]
+        if captured_piece_type:
+            self.score -= PIECE_SQUARE_VALUES[not color][captured_piece_type][capture_square]
+            self.phase -= PHASE_WEIGHTS[captured_piece_type]
+            if captured_piece_type == PAWN:
+                self.pawn_key ^= Z_PIECES[not color][PAWN][capture_square]
+
+    def pop(self):
+        self.score, self.phase, self.pawn_key = self._score_stack.pop()
+        return super().pop()
+
+    def evaluate(self, alpha = None, beta = None):
+        """ evaluation from the perspective of the side to move - given an (alpha, beta) window, this may return only
+            the cheap part of it (material, piece squares and pawns) when that is far enough outside the window """
 
         # return evaluation from transposition table if exists
         board_hash = self.get_hash()
-        if board_hash in self.evals:
-            return self.evals[board_hash]
+        ev = self.evals.get(board_hash)
+        if ev is not None:
+            return ev
 
-        # check stalemate and insiffucient material - but only during endgame
-        if self.endgame and (self.is_stalemate() or self.is_insufficient_material()):
+        # check stalemate and insiffucient material - but only with little material left
+        phase = self.phase
+        if phase <= ENDGAME_PHASE and (self.is_stalemate() or self.is_insufficient_material()):
             return 0
     
-        # main evaluation
-        ev = self.piece_eval(WHITE) - self.piece_eval(BLACK)
-
         # for negamax, evaluation must always be from the perspective of the current player
-        ev = ev * (-1,1)[self.turn]
+        sign = (-1,1)[self.turn]
+
+        # the incrementally updated material and piece square score, and the pawn hash - if that's already way
+        # outside of the window, skip the rest (and don't store it, as it's not the full evaluation)
+        score = self.score + self.pawn_eval()
+        if alpha is not None:
+            ev = sign * taper(score, phase)
+            if ev + self.LAZY_MARGIN <= alpha or ev - self.LAZY_MARGIN >= beta:
+                self.lazy_exits += 1
+                return ev
+
+        # main evaluation: add the piece terms, and taper between the middlegame and endgame values
+        self.full_evals += 1
+        score += self.piece_eval(WHITE) - self.piece_eval(BLACK)
+        if self.KING_SAFETY:
+            white_attacks = self.attack_maps(WHITE)[3]
+            black_attacks = self.attack_maps(BLACK)[3]
+            score += (self.king_eval(WHITE, white_attacks, black_attacks) -
+                      self.king_eval(BLACK, black_attacks, white_attacks))
+        ev = sign * taper(score, phase)
 
         # store evaluation
         self.evals[board_hash] = ev
@@ -128,142 +310,144 @@ class EvalBoard(Board):
         return ev
 
     def piece_eval(self, color):
+        # packed score of the piece terms that aren't part of the material and piece square score: bishop pair,
+        # mobility and attacks on the enemy king zone
+        attacks, double_attacks, mobility, attacks_of = self.attack_maps(color)
+        king_zone = BB_KING_ATTACKS[self.king(not color)]
+        king_zone_attacks = 0
+        for a in attacks_of:
+            king_zone_attacks += popcount(a & king_zone)
+        score = mobility * MOBILITY_SCORE + king_zone_attacks * KING_ZONE_ATTACK_SCORE
+        if popcount(self.bishops & self.occupied_co[color]) == 2:
+            score += BISHOP_PAIR_SCORE
+        return score
+
+    def king_eval(self, color, piece_attacks, their_piece_attacks):
+        # king safety score from the game stats, by the color's pawns, its king square and the number of its own and
+        # the enemy's pieces (other than pawns and kings) attacking the squares around the king - given the attacks
+        # of each piece of both colors (from attack_maps)
+        table = king_safety.get_table()
+        if table is None:
+            return 0
+        king_sq = self.king(color)
+        king_zone = BB_KING_ATTACKS[king_sq]
+        num_def = 0
+        for a in piece_attacks:
+            if a & king_zone:
+                num_def += 1
+        num_att = 0
+        for a in their_piece_attacks:
+            if a & king_zone:
+                num_att += 1
+        return make_score(table.lookup(self.pawns & self.occupied_co[color], king_sq, min(num_def, 31),
+                                       min(num_att, 31), color), 0)
+
+    def attack_maps(self, color):
+        """ (attacked squares, squares attacked more than once, slider mobility, attacks of each knight and slider)
+            of the given color - computed set-wise once, and cached by the occupied squares and the color's pieces """
         o = self.occupied_co[color]
-        pawns = self.pawns & o
-        knights = self.knights & o
-        bishops = self.bishops & o
-        rooks = self.rooks & o
-        queens = self.queens & o
-        kings = self.kings & o
-
-        return (self.pawn_eval(pawns, color) +
-                self.knight_eval(knights, color) +
-                self.bishop_eval(bishops, color) +
-                self.rook_eval(rooks, color) +
-                self.queen_eval(queens, color) +
-                self.king_eval(kings, pawns, color))
-
-    def pawn_eval(self, pawns, color):
-        p_hash = self.p_hash[color][self.endgame]
-        if pawns in p_hash:
-            p_val = p_hash[pawns]
-        else:
-            p_val = PIECE_VALUES[PAWN] * self._bb_count(pawns)
-            # check for double pawns
-            for fl in BB_FILES:
-                p_count = self._bb_count(pawns & fl)
-                if p_count > 1:
-                    p_val -= (p_count-1) * 15
-            if self.endgame:
-                for sq in scan_forward(pawns):
-                    p_val += EG_PAWN_SQ_TABLE[color][sq]
-            else:
-                for sq in scan_forward(pawns):
-                    p_val += MG_PAWN_SQ_TABLE[color][sq]
-            p_hash[pawns] = p_val
-
-        pp_hash = self.pp_hash[color][self.endgame]
-        their_pawns = self.pawns & self.occupied_co[not color]
-        pp_key = (pawns, their_pawns)
-        if pp_key in pp_hash:
-            passed_eval = pp_hash[pp_key]
-        else:
-            passed_eval = 0
-            for i in scan_forward(pawns):
-                stoppers = PAWN_STOPPERS[color][i]
-                if not (stoppers & their_pawns):
-                    # passed pawn
-                    relative_rank = square_rank(i) if color else 7 - square_rank(i)
-                    # TODO: bigger bonus in endgame
-                    bonus = int(12 * (relative_rank/2))
-                    passed_eval += bonus
-            pp_hash[pp_key] = passed_eval
-        p_val += passed_eval
-        return p_val
-
-    def knight_eval(self, knights, color):
-        n_hash = self.n_hash[color][self.endgame]
-        if knights in n_hash:
-            n_val = n_hash[knights]
+        key = (self.occupied, self.pawns & o, self.knights & o, self.bishops & o, self.rooks & o, self.queens & o,
+               self.kings & o)
+        maps = self.attack_hash.get(key)
+        if maps is None:
+            maps = self._attack_maps(color, *key)
+            self.attack_hash[key] = maps
+        return maps
+
+    def _attack_maps(self, color, occupied, pawns, knights, bishops, rooks, queens, kings):
+        # pawns all at once
+        if color:
+            left = pawns << 7 & BB_NOT_FILE_H
+            right = pawns << 9 & BB_NOT_FILE_A
         else:
-            n_val = PIECE_VALUES[KNIGHT] * self._bb_count(knights)
-            for sq in scan_forward(knights):
-                n_val += KNIGHT_ATTACK_TABLE[sq] * SQUARE_VALUE
-                if self.endgame:
-                    n_val += EG_KNIGHT_SQ_TABLE[color][sq]
-                else:
-                    n_val += MG_KNIGHT_SQ_TABLE[color][sq]
-            n_hash[knights] = n_val
-        return n_val
-
-    def bishop_eval(self, bishops, color):
-        b_hash = self.b_hash[color][self.endgame]
-        if bishops in b_hash:
-            b_val = b_hash[bishops]
-        else:
-            num_bishops = self._bb_count(bishops)
-            b_val = PIECE_VALUES[BISHOP] * num_bishops
-            if num_bishops == 2:
-                # bishop pair bonus
-                b_val += 50
-            for sq in scan_forward(bishops):
-                if self.endgame:
-                    b_val += EG_BISHOP_SQ_TABLE[color][sq]
-                else:
-                    b_val += MG_BISHOP_SQ_TABLE[color][sq]
-            b_hash[bishops] = b_val
-        for i in scan_forward(bishops):
-            b_val += self._bb_count(self.attacks_mask(i)) * SQUARE_VALUE
-        return b_val
-
-    def rook_eval(self, rooks, color):
-        r_hash = self.r_hash[color][self.endgame]
-        if rooks in r_hash:
-            r_val = r_hash[rooks]
-        else:
-            r_val = PIECE_VALUES[ROOK] * self._bb_count(rooks)
-            for sq in scan_forward(rooks):
-                if self.endgame:
-                    r_val += EG_ROOK_SQ_TABLE[color][sq]
-                else:
-                    r_val += MG_ROOK_SQ_TABLE[color][sq]
-            r_hash[rooks] = r_val
-        for i in scan_forward(rooks):
-            r_val += self._bb_count(self.attacks_mask(i)) * SQUARE_VALUE
-        return r_val
-
-    def queen_eval(self, queens, color):
-        q_hash = self.q_hash[color][self.endgame]
-        if queens in q_hash:
-            q_val = q_hash[queens]
-        else:
-            q_val = PIECE_VALUES[QUEEN] * self._bb_count(queens)
-            for sq in scan_forward(queens):
-                if self.endgame:
-                    q_val += EG_QUEEN_SQ_TABLE[color][sq]
-                else:
-                    q_val += MG_QUEEN_SQ_TABLE[color][sq]
-            q_hash[queens] = q_val
-        for i in scan_forward(queens):
-            q_val += self._bb_count(self.attacks_mask(i)) * SQUARE_VALUE
-        return q_val
-
-    def king_eval(self, kings, pawns, color):
-        king_sq = msb(kings)
-        val = self._king_pawns_eval(king_sq, pawns, color)
-        if self.endgame:
-            val += EG_KING_SQ_TABLE[color][king_sq]
-        else:
-            val += MG_KING_SQ_TABLE[color][king_sq]
+            left = pawns >> 9 & BB_NOT_FILE_H
+            right = pawns >> 7 & BB_NOT_FILE_A
+        attacks = (left | right) & BB_ALL
+        double_attacks = left & right
+        attacks_of = [BB_KING_ATTACKS[msb(kings)]]
+        for sq in scan_forward(knights):
+            attacks_of.append(BB_KNIGHT_ATTACKS[sq])
+        # mobility counts only the sliders (knights have theirs in the piece square values)
+        mobility = 0
+        for sq in scan_forward(bishops | queens):
+            a = BB_BISHOP_ATTACKS[sq][BB_BISHOP_MASKS[sq] & occupied]
+            mobility += popcount(a)
+            attacks_of.append(a)
+        for sq in scan_forward(rooks | queens):
+            a = BB_ROOK_ATTACKS[sq][BB_ROOK_MASKS[sq] & occupied]
+            mobility += popcount(a)
+            attacks_of.append(a)
+        for a in attacks_of:
+            double_attacks |= attacks & a
+            attacks |= a
+        # the king's attacks are first, and not included in the king zone attacks
+        return attacks, double_attacks, mobility, attacks_of[1:]
+
+    def hanging_pieces(self, color):
+        """ pieces of the given color (other than the king) that are attacked and not defended """
+        o = self.occupied_co[color] & ~self.kings
+        return o & self.attack_maps(not color)[0] & ~self.attack_maps(color)[0]
+
+    def pawn_eval(self):
+        # packed score of the pawn structure of both colors, from white's perspective: everything that depends
+        # only on the pawns is kept in a single pawn hash entry by the pawn key - (structure score, king shelter
+        # scores of each color by king square) - so that only the kings' shelter has to be looked up here
+        entry = self.pawn_hash.get(self.pawn_key)
+        if entry is None:
+            entry = self._pawn_entry()
+            self.pawn_hash[self.pawn_key] = entry
+        structure, shelter = entry
+        return structure + self._shelter_eval(shelter, WHITE) - self._shelter_eval(shelter, BLACK)
+
+    def _pawn_entry(self):
+        structure = 0
+        for color in (BLACK, WHITE):
+            pawns = self.pawns & self.occupied_co[color]
+            their_pawns = self.pawns & self.occupied_co[not color]
+            val = self._pawn_structure_eval(pawns, their_pawns, color)
+            structure += val if color else -val
+        return structure, ({}, {})
+
+    def _shelter_eval(self, shelter, color):
+        # the shelter values of an entry are filled in as the kings get to each shelter square (which are different
+        # squares for each color) - outside of them there's no shelter score, also on the other color's squares
+        king_sq = self.king(color)
+        if not king_sq in KING_SHELTER_SQUARES[color]:
+            return 0
+        shelter = shelter[color]
+        val = shelter.get(king_sq)
+        if val is None:
+            val = shelter[king_sq] = self._king_pawns_eval(king_sq, self.pawns & self.occupied_co[color], color)
         return val
 
+    def _pawn_structure_eval(self, pawns, their_pawns, color):
+        p_val = 0
+        # check for double pawns
+        for fl in BB_FILES:
+            p_count = self._bb_count(pawns & fl)
+            if p_count > 1:
+                p_val += (p_count-1) * DOUBLED_PAWN_SCORE
+
+        for i in scan_forward(pawns):
+            stoppers = PAWN_STOPPERS[color][i]
+            if not (stoppers & their_pawns):
+                # passed pawn
+                relative_rank = square_rank(i) if color else 7 - square_rank(i)
+                # TODO: bigger bonus in endgame
+                bonus = int(12 * (relative_rank/2))
+                p_val += make_score(bonus, bonus)
+            if not (pawns & ADJACENT_FILES[i & 7]):
+                p_val += ISOLATED_PAWN_SCORE
+            elif not (pawns & PAWN_SUPPORT_MASKS[color][i]):
+                # no pawn can defend it, and it can't advance without being taken
+                stop_square = i + 8 if color else i - 8
+                if BB_PAWN_ATTACKS[color][stop_square] & their_pawns:
+                    p_val += BACKWARD_PAWN_SCORE
+        return p_val
+
     def _king_pawns_eval(self, king_sq, pawns, color):
         # TODO: this should be changed - calc for king in any position...
-        if not king_sq in KING_SHELTER_SQUARES[color] or self.endgame:
-            return 0
-        kp_key = (king_sq, pawns)
-        if kp_key in self.kp_hash:
-            return self.kp_hash[kp_key]
+        # (a middlegame only term, so it fades out as the pieces come off)
         # king is in shelter position, calculate pawn shield bonus
         pawn_shields = PAWN_SHIELD_MASKS[king_sq]
         shield_center = 2**(king_sq + 8 * (-1,1)[color])
@@ -281,8 +465,7 @@ class EvalBoard(Board):
                 if shield_file & shield_center:
                     # extra penalty for open file in front of king
                     kp_val -= 25
-        self.kp_hash[kp_key] = kp_val
-        return kp_val
+        return make_score(kp_val, 0)
 
     def _bb_count(self, x):
         x = (x & 0x5555555555555555) + ((x >> 1) & 0x5555555555555555)
@@ -291,28 +474,3 @@ class EvalBoard(Board):
         x = (x & 0x00FF00FF00FF00FF) + ((x >> 8) & 0x00FF00FF00FF00FF)
         x = (x & 0x0000FFFF0000FFFF) + ((x >> 16) & 0x0000FFFF0000FFFF)
         return (x & 0x00000000FFFFFFFF) + ((x >> 32) & 0x00000000FFFFFFFF)
-
-    def table_maintenance(self):
-        limits = {
-            'evals': self.HASH_SIZE,
-            'kp_hash': self.HASH_SIZE/10,
-        }
-        for var, limit in limits.items():
-            table = getattr(self, var)
-            if len(table) > limit:
-                table.clear()
-        limits = {
-            'pp_hash': self.HASH_SIZE/4,
-            'p_hash': self.HASH_SIZE/8,
-            'n_hash': self.HASH_SIZE/10,
-            'b_hash': self.HASH_SIZE/10,
-            'r_hash': self.HASH_SIZE/10,
-            'q_hash': self.HASH_SIZE/10,
-        }
-        for var, limit in limits.items():
-            table = getattr(self, var)
-            for color in (BLACK, WHITE):
-                for endgame in (True, False):
-                    table = getattr(self, var)[color][endgame]
-                    if len(table) > limit:
-                        table.clear()
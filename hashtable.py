@@ -0,0 +1,90 @@
+from array import array
+
+# BOUNDED HASH TABLES
+# the engine and eval caches used to be plain dicts that were cleared once they got too big - which throws away
+# the hot entries along with the rest, and the node rate visibly drops right after. instead, a HashTable has a
+# fixed number of slots, preallocated so memory stays flat for the whole game: each key maps to a single slot,
+# and storing a key simply replaces whatever was in its slot.
+#
+# slots keep the key's hash rather than the key itself (like the key check of a transposition table), in flat
+# arrays - which is both smaller and faster than lists of int objects. ints hash to themselves and tuples of ints
+# to a 64 bit hash, so a false hit would take two keys whose hashes are equal, which is a risk we can take.
+#
+# the interface is the dict subset the caches use (get, [] assignment, len, clear), plus hit/eviction stats.
+
+# hash() never returns -1 (it's an error code in cpython), so it can mark empty slots
+EMPTY = -1
+
+def _next_prime(n):
+    # the slot is the hash modulo the table size, which has to be prime: the low bits of a bitboard key
+    # (e.g. pawns) are far from random
+    n = max(n, 2)
+    while any(n % i == 0 for i in range(2, int(n ** .5) + 1)):
+        n += 1
+    return n
+
+class HashTable(object):
+
+    __slots__ = ('name', 'size', 'int_values', 'keys', 'values', 'used', 'hits', 'misses', 'evictions')
+
+    def __init__(self, size, name = '', int_values = True):
+        # int_values: values are kept in an array of signed 64 bit ints, otherwise in a list of objects
+        self.name = name
+        self.size = _next_prime(int(size))
+        self.int_values = int_values
+        self.clear()
+
+    def clear(self):
+        size = self.size
+        self.keys = array('q', [EMPTY]) * size
+        self.values = array('q', [0]) * size if self.int_values else [None] * size
+        self.used = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return self.used
+
+    def get(self, key, default = None):
+        h = hash(key)
+        i = h % self.size
+        if self.keys[i] == h:
+            self.hits += 1
+            return self.values[i]
+        self.misses += 1
+        return default
+
+    def __setitem__(self, key, value):
+        h = hash(key)
+        i = h % self.size
+        slot_key = self.keys[i]
+        if slot_key == EMPTY:
+            self.used += 1
+        elif slot_key != h:
+            self.evictions += 1
+        self.keys[i] = h
+        self.values[i] = value
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'used': self.used,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate(),
+        }
+
+    def __str__(self):
+        return '%s: %.0f%% hits (%d lookups), %d evictions, %.0f%% full' % (
+                self.name, 100 * self.hit_rate(), self.hits + self.misses, self.evictions, 100 * self.used / self.size)
+
+    __repr__ = __str__
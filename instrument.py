@@ -0,0 +1,102 @@
+import json
+import time
+
+from eval import EvalBoard
+
+# EVAL INSTRUMENTATION
+# opt in: enable() replaces the eval term methods of EvalBoard with wrappers that count calls and time them, and
+# disable() puts the originals back - so when it's off nothing is added to the eval at all. times are inclusive
+# (e.g. piece_eval's includes its attack_maps calls) and include the wrappers' own overhead, so they're mostly
+# useful compared to each other.
+#
+# the stats (terms, and per engine the hash tables and lazy evaluation counts) are plain dicts, for exporting as
+# json - see speedtest.py --stats and Engine.play.
+
+EVAL_TERMS = [
+    'evaluate',
+    'is_stalemate',
+    'is_insufficient_material',
+    'pawn_eval',
+    '_pawn_entry',
+    '_shelter_eval',
+    'piece_eval',
+    'king_eval',
+    'attack_maps',
+    '_attack_maps',
+    'hanging_pieces',
+]
+
+class EvalStats(object):
+
+    def __init__(self, board_class = EvalBoard):
+        self.board_class = board_class
+        self.calls = {}
+        self.times = {}
+        self._originals = {}
+
+    def enable(self):
+        cls = self.board_class
+        for name in EVAL_TERMS:
+            if name in self._originals:
+                continue
+            # inherited methods (e.g. is_stalemate) are wrapped on the class too, and removed from it on disable
+            self._originals[name] = cls.__dict__.get(name)
+            setattr(cls, name, self._wrap(name, getattr(cls, name)))
+
+    def disable(self):
+        cls = self.board_class
+        for name, f in self._originals.items():
+            if f is None:
+                delattr(cls, name)
+            else:
+                setattr(cls, name, f)
+        self._originals = {}
+
+    def _wrap(self, name, f):
+        calls = self.calls
+        times = self.times
+        calls[name] = 0
+        times[name] = 0
+        clock = time.perf_counter
+        def wrap(*args, **kwargs):
+            t0 = clock()
+            ret = f(*args, **kwargs)
+            times[name] += clock() - t0
+            calls[name] += 1
+            return ret
+        wrap.__name__ = f.__name__
+        return wrap
+
+    def reset(self):
+        for name in self.calls:
+            self.calls[name] = 0
+            self.times[name] = 0
+
+    def term_stats(self):
+        """ {term: {calls, time, us_per_call}} """
+        return {name: {
+                    'calls': calls,
+                    'time': self.times[name],
+                    'us_per_call': 1000000 * self.times[name] / calls if calls else 0,
+                } for name, calls in self.calls.items()}
+
+    def engine_stats(self, engine):
+        """ the engine's node count, lazy evaluation counts and the stats of each of its hash tables """
+        board = engine.board
+        return {
+            'nodes': engine.nodes,
+            'full_evals': board.full_evals,
+            'lazy_exits': board.lazy_exits,
+            'tables': {table.name: table.stats() for table in engine.hash_tables()},
+        }
+
+    def report(self):
+        lines = []
+        for name, stats in self.term_stats().items():
+            if stats['calls']:
+                lines.append('%s: %.2fs, %d x %.2fus' % (name, stats['time'], stats['calls'], stats['us_per_call']))
+        return '\n'.join(lines)
+
+def dump(path, stats):
+    with open(path, 'w') as f:
+        json.dump(stats, f, indent=2)
@@ -0,0 +1,168 @@
+import argparse
+import mmap
+import os
+import pickle
+import struct
+import time
+
+from array import array
+
+# COMPILED KING SAFETY TABLE
+# the king safety stats (w_ks_all.pkl / b_ks_all.pkl: (score, games) for each (pawns, king, num_def, num_att) seen
+# in the game database) are huge dicts, which take seconds to unpickle and a lot of memory to keep around. they
+# are compiled offline (see main below) into a single binary file of precomputed scores, which is memory mapped
+# on first use - so loading is just an mmap, and only the pages that are actually looked up are read in.
+#
+# each (pawns, king, num_def, num_att) key is packed into a single 64 bit int - pawns can't be on the first and
+# last ranks, so the pawns bitboard takes 48 bits, the king square 6 and the counts 5 each:
+#
+#   pawns >> 8 << 16 | king << 10 | num_def << 5 | num_att
+#
+# the file has a header, then for each color (black, white) an open addressing hash table of packed keys - slot
+# key % size (a prime), with linear probing - then the matching array of 16 bit scores. the tables are at most
+# half full, so a lookup is typically a probe or two. a sorted array of keys with a binary search (by bisect, in
+# C) was tried as well, but that's ~20 probes that each allocate an int, and about twice as slow.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_analysis')
+TABLE_FILE = os.path.join(DATA_DIR, 'king_safety.bin')
+
+MAGIC = b'KSAF'
+VERSION = 2
+# written in native byte order, so a file from a machine of the other byte order is rejected rather than misread
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct('=4sIIII') # magic, version, byte order mark, number of slots for black, for white
+
+# stats of fewer games than this aren't used
+MIN_GAMES = 100
+# the score range the win ratio is mapped to
+MIN_SCORE = -150
+MAX_SCORE = 150
+
+PAWN_BITS = 48
+COUNT_BITS = 5
+PAWNS_MASK = (1 << PAWN_BITS) - 1 << 8 # ranks 2-7
+# no packed key can have all the pawn bits set
+EMPTY = (1 << 64) - 1
+
+def _next_prime(n):
+    while any(n % i == 0 for i in range(2, int(n ** .5) + 1)):
+        n += 1
+    return n
+
+def pack_key(pawns, king, num_def, num_att):
+    return pawns >> 8 << 16 | king << 10 | num_def << 5 | num_att
+
+def ratio_score(score, games):
+    # linear from MIN_SCORE for a ratio of 0 to MAX_SCORE for a ratio of 1
+    return int((MAX_SCORE - MIN_SCORE) * (score / games - 1) + MAX_SCORE)
+
+def compile_stats(stats):
+    """ (packed key slots, scores) arrays from a {(pawns, king, num_def, num_att): (score, games)} dict """
+    table = {}
+    for (pawns, king, num_def, num_att), (score, games) in stats.items():
+        if games <= MIN_GAMES:
+            continue
+        if pawns & ~PAWNS_MASK or not 0 <= king < 64 or not 0 <= num_def < 1 << COUNT_BITS or \
+                not 0 <= num_att < 1 << COUNT_BITS:
+            raise ValueError('king safety key out of range: %s' % ((pawns, king, num_def, num_att),))
+        table[pack_key(pawns, king, num_def, num_att)] = ratio_score(score, games)
+    size = _next_prime(2 * len(table) + 1)
+    keys = array('Q', [EMPTY]) * size
+    scores = array('h', [0]) * size
+    for key, score in table.items():
+        i = key % size
+        while keys[i] != EMPTY:
+            i = (i + 1) % size
+        keys[i] = key
+        scores[i] = score
+    return keys, scores
+
+def write_table(path, tables):
+    """ tables: [(keys, scores) for black, for white] """
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, BYTE_ORDER_MARK, len(tables[0][0]), len(tables[1][0])))
+        # all the keys first, so they stay 8 byte aligned
+        for keys, _ in tables:
+            keys.tofile(f)
+        for _, scores in tables:
+            scores.tofile(f)
+
+class KingSafetyTable(object):
+
+    __slots__ = ('_mmap', 'keys', 'scores')
+
+    def __init__(self, path = TABLE_FILE):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError('%s: truncated king safety table' % path)
+            magic, version, byte_order, n_black, n_white = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION or byte_order != BYTE_ORDER_MARK:
+                raise ValueError('%s: not a king safety table of this version and byte order' % path)
+            # 8 byte keys and 2 byte scores
+            if os.fstat(f.fileno()).st_size != HEADER.size + 10 * (n_black + n_white):
+                raise ValueError('%s: king safety table of the wrong size' % path)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        offset = HEADER.size
+        self.keys = []
+        for n in (n_black, n_white):
+            self.keys.append(view[offset:offset + 8 * n].cast('Q'))
+            offset += 8 * n
+        self.scores = []
+        for n in (n_black, n_white):
+            self.scores.append(view[offset:offset + 2 * n].cast('h'))
+            offset += 2 * n
+
+    def lookup(self, pawns, king, num_def, num_att, color):
+        """ king safety score for the given color, 0 if there aren't enough games with this key """
+        key = pawns >> 8 << 16 | king << 10 | num_def << 5 | num_att # pack_key, inlined
+        keys = self.keys[color]
+        size = len(keys)
+        i = key % size
+        while True:
+            k = keys[i]
+            if k == key:
+                return self.scores[color][i]
+            if k == EMPTY:
+                return 0
+            i += 1
+            if i == size:
+                i = 0
+
+_table = None
+
+def get_table():
+    """ the compiled table, mapped on first use - None if it hasn't been compiled (or the file is broken) """
+    global _table
+    if _table is None:
+        try:
+            _table = KingSafetyTable()
+        except (OSError, ValueError):
+            _table = False
+    return _table if _table is not False else None
+
+def available():
+    # doesn't load the table
+    return os.path.exists(TABLE_FILE)
+
+def get_args():
+    parser = argparse.ArgumentParser(description='compile the king safety stats into a memory mapped table')
+    parser.add_argument('--white', default=os.path.join(DATA_DIR, 'w_ks_all.pkl'))
+    parser.add_argument('--black', default=os.path.join(DATA_DIR, 'b_ks_all.pkl'))
+    parser.add_argument('--out', default=TABLE_FILE)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+    t0 = time.time()
+    tables = []
+    for path in (args.black, args.white):
+        with open(path, 'rb') as f:
+            stats = pickle.load(f)
+        keys, scores = compile_stats(stats)
+        print('%s: %d keys, %d with more than %d games' % (path, len(stats), len(keys) - keys.count(EMPTY),
+                                                           MIN_GAMES))
+        tables.append((keys, scores))
+    write_table(args.out, tables)
+    print('wrote %s [%d bytes, %.2fs]' % (args.out, os.path.getsize(args.out), time.time() - t0))
@@ -0,0 +1,140 @@
+import argparse
+import time
+
+from board import SearchBoard, decode_move
+
+# perft: counts the leaf nodes of the legal move tree to a given depth, for validating
+# (and timing) move generation and push/pop - see https://www.chessprogramming.org/Perft
+
+# standard positions with known counts by depth (index 0 is depth 1)
+# mostly from https://www.chessprogramming.org/Perft_Results and the talkchess edge case suite
+POSITIONS = [
+    ('startpos', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+        [20, 400, 8902, 197281, 4865609]),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+        [48, 2039, 97862, 4085603]),
+    ('position 3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+        [14, 191, 2812, 43238, 674624]),
+    ('position 4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+        [6, 264, 9467, 422333]),
+    ('position 5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+        [44, 1486, 62379, 2103487]),
+    ('position 6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+        [46, 2079, 89890, 3894594]),
+    # en passant
+    ('illegal ep (pin)', '3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1',
+        [18, 92, 1670, 10138]),
+    ('illegal ep (rank skewer)', '8/8/8/8/k2Pp2Q/8/8/3K4 b - d3 0 1',
+        [6, 136, 863, 20471]),
+    ('ep capture checks', '8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1',
+        [13, 102, 1266, 10276]),
+    ('ep out of pin', '8/5k2/8/2Pp4/2B5/1K6/8/8 w - d6 0 1',
+        [15, 126, 1928, 13931]),
+    # castling
+    ('castling rights', 'r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1',
+        [26, 1141, 27826]),
+    ('castling through check', 'r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1',
+        [44, 1494, 50509]),
+    # promotion
+    ('promote out of check', '2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1',
+        [11, 133, 1442, 19174]),
+    ('underpromotion', '8/P1k5/K7/8/8/8/8/8 w - - 0 1',
+        [6, 27, 273, 1329, 18135]),
+    ('promotions', 'n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1',
+        [24, 496, 9483, 182838]),
+]
+
+def perft(board, depth):
+    if depth == 0:
+        return 1
+    moves = board.generate_legal_moves()
+    if depth == 1:
+        # bulk counting: the leaves don't need to be made
+        return len(moves)
+    nodes = 0
+    push = board.push
+    pop = board.pop
+    for move in moves:
+        push(move)
+        nodes += perft(board, depth - 1)
+        pop()
+    return nodes
+
+def perft_hashed(board, depth, table = None):
+    # perft with transpositions counted once: the table maps (key, depth) to a subtree count
+    if table is None:
+        table = {}
+    if depth <= 1:
+        return perft(board, depth)
+    key = (board.get_hash(), depth)
+    nodes = table.get(key)
+    if nodes is not None:
+        return nodes
+    nodes = 0
+    for move in board.generate_legal_moves():
+        board.push(move)
+        nodes += perft_hashed(board, depth - 1, table)
+        board.pop()
+    table[key] = nodes
+    return nodes
+
+def divide(board, depth, hashed = False):
+    """ returns the perft count under each root move """
+    table = {}
+    counts = {}
+    for move in board.generate_legal_moves():
+        board.push(move)
+        counts[move] = perft_hashed(board, depth - 1, table) if hashed else perft(board, depth - 1)
+        board.pop()
+    return counts
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--depth', default=3, type=int, help='max depth for the suite, exact depth with --fen')
+    parser.add_argument('--fen', type=str, help='run a single position instead of the suite')
+    parser.add_argument('--divide', action='store_true')
+    parser.add_argument('--hashed', action='store_true')
+    return parser.parse_args()
+
+def run_fen(args):
+    board = SearchBoard(args.fen)
+    t0 = time.time()
+    if args.divide:
+        counts = divide(board, args.depth, args.hashed)
+        for move, count in counts.items():
+            print('%s: %d' % (decode_move(move).uci(), count))
+        nodes = sum(counts.values())
+    elif args.hashed:
+        nodes = perft_hashed(board, args.depth)
+    else:
+        nodes = perft(board, args.depth)
+    t = time.time() - t0
+    print('nodes: %d [%.2fs, %.1fk nps]' % (nodes, t, nodes / t / 1000))
+
+def run_suite(args):
+    total_nodes = 0
+    total_time = 0
+    failed = 0
+    for name, fen, counts in POSITIONS:
+        board = SearchBoard(fen)
+        for depth, expected in enumerate(counts[:args.depth], 1):
+            t0 = time.time()
+            nodes = perft_hashed(board, depth) if args.hashed else perft(board, depth)
+            t = time.time() - t0
+            total_nodes += nodes
+            total_time += t
+            if nodes != expected:
+                failed += 1
+            print('%-24s depth %d: %d%s [%.2fs]' % (name, depth, nodes,
+                    '' if nodes == expected else ' FAILED (expected %d)' % expected, t))
+    print('------')
+    print('total nodes: %d [%.2fs, %.1fk nps]' % (total_nodes, total_time, total_nodes / total_time / 1000))
+    print('all passed' if not failed else '%d FAILED' % failed)
+    return failed
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.fen:
+        run_fen(args)
+    else:
+        exit(1 if run_suite(args) else 0)
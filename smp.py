@@ -0,0 +1,230 @@
+import argparse
+import chess
+import multiprocessing
+import time
+
+from board import decode_move
+from engine import Engine
+from speedtest import POSITIONS
+from tt import TranspositionTable
+
+# LAZY SMP
+# a parallel search with no coordination beyond a shared transposition table: each worker process runs the usual
+# iterative deepening on the same root, and they speed each other up through the entries they store - a helper
+# that's ahead on a subtree leaves a tt cutoff (or at least a tt move) for the others to find. the table is in a
+# shared memory block, which every worker maps (see TranspositionTable.shared).
+#
+# worker 0 searches just like Engine does. the helpers skip some depths (in the pattern stockfish used for its
+# helper threads) and rotate the root moves after the first, so that they're spread over different parts of the
+# tree rather than all repeating the same search. the main process only hands out the position and collects the
+# results: each worker reports each depth it completes, and the deepest one is the result. when any worker is done
+# (out of time, or at the max depth) the rest are stopped.
+#
+# there are no locks on the table - two workers storing into the same slot at once may leave a slot whose key
+# check and entry come from different stores, which the check's xor with the entry catches (see tt.py).
+
+# helper i skips depth d if (d + SKIP_PHASE[i]) // SKIP_SIZE[i] is odd
+SKIP_SIZE = [1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 3, 3, 4, 4, 4, 4, 4, 4, 4, 4]
+SKIP_PHASE = [0, 1, 0, 1, 2, 3, 0, 1, 2, 3, 4, 5, 0, 1, 2, 3, 4, 5, 6, 7]
+
+class WorkerEngine(Engine):
+
+    BOOK = False
+
+    def __init__(self, worker_id, tt, results, stop):
+        self.worker_id = worker_id
+        self.shared_tt = tt
+        self.results = results
+        self.stop = stop
+        super().__init__()
+
+    def _init_tt(self):
+        self.tt = self.shared_tt
+
+    def _check_time(self):
+        super()._check_time()
+        if self.stop.is_set():
+            self.time_over = True
+
+    def _skip_depth(self, depth):
+        # the last depth is never skipped, so that every worker can complete the search
+        if not self.worker_id or depth >= self.MAX_ITER_DEPTH:
+            return False
+        i = (self.worker_id - 1) % len(SKIP_SIZE)
+        return (depth + SKIP_PHASE[i]) // SKIP_SIZE[i] % 2 == 1
+
+    def _root_moves(self):
+        moves = super()._root_moves()
+        if self.worker_id and len(moves) > 2:
+            k = self.worker_id % (len(moves) - 1)
+            moves = moves[:1] + moves[1 + k:] + moves[1:1 + k]
+        return moves
+
+    def _depth_done(self, depth, move, value):
+        self.results.put(('depth', self.worker_id, depth, move, value, self.time_over))
+
+def _worker(worker_id, shm_name, tt_mb, jobs, results, stop):
+    tt = TranspositionTable.attach(shm_name, tt_mb)
+    engine = WorkerEngine(worker_id, tt, results, stop)
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        fen, moves, max_depth, move_time, new_game, age = job
+        board = chess.Board(fen)
+        for move in moves:
+            board.push_uci(move)
+        if new_game:
+            engine._init_game_state()
+        engine.board.set_board(board)
+        engine.nodes = 0
+        engine.MAX_ITER_DEPTH = max_depth
+        engine.move_time_limit = move_time
+        # (which _select_move then moves on to the search's age)
+        tt.age = age
+        engine._select_move()
+        results.put(('done', worker_id, engine.nodes))
+    del engine
+    tt.close()
+
+class LazySMP(object):
+
+    def __init__(self, workers, tt_mb = Engine.TT_MB):
+        self.tt = TranspositionTable.shared(tt_mb)
+        self.results = multiprocessing.Queue()
+        self.stop = multiprocessing.Event()
+        self.jobs = []
+        self.processes = []
+        for i in range(workers):
+            jobs = multiprocessing.Queue()
+            process = multiprocessing.Process(target = _worker, daemon = True,
+                    args = (i, self.tt.shm.name, tt_mb, jobs, self.results, self.stop))
+            process.start()
+            self.jobs.append(jobs)
+            self.processes.append(process)
+
+    def search(self, board, max_depth, move_time, new_game = False):
+        """ (move, value, depth, nodes, time to depth) for the chess.Board - the deepest completed result """
+        root = board.root()
+        moves = [move.uci() for move in board.move_stack]
+        if new_game:
+            self.tt.clear()
+        # the entries' age is kept here, and sent to the workers with each search - each of them has its own copy
+        # of it, which would otherwise miss a clear
+        age = self.tt.age
+        self.tt.new_search()
+        self.stop.clear()
+        t0 = time.time()
+        for jobs in self.jobs:
+            jobs.put((root.fen(), moves, max_depth, move_time, new_game, age))
+        best = None
+        depth_time = None
+        nodes = 0
+        done = 0
+        while done < len(self.jobs):
+            msg = self.results.get()
+            if msg[0] == 'done':
+                # the first worker that's done stops the rest
+                self.stop.set()
+                nodes += msg[2]
+                done += 1
+                continue
+            _, worker_id, depth, move, value, aborted = msg
+            if aborted:
+                # only depths that were searched to the end count
+                continue
+            if best is None or depth > best[2]:
+                best = (move, value, depth)
+                depth_time = time.time() - t0
+        if best is None:
+            return None, None, 0, nodes, depth_time
+        move, value, depth = best
+        return decode_move(move), value, depth, nodes, depth_time
+
+    def close(self):
+        for jobs in self.jobs:
+            jobs.put(None)
+        for process in self.processes:
+            process.join()
+        self.tt.close(unlink = True)
+
+class ParallelEngine(Engine):
+
+    # a game engine whose moves are searched by LazySMP - call close() when done with it
+    WORKERS = 4
+
+    def __init__(self, workers = None):
+        self.workers = workers or self.WORKERS
+        self.smp = None
+        super().__init__()
+
+    def _init_tt(self):
+        # the table is the one shared by the workers (so they're started here) - a new game clears it on the next
+        # search
+        if self.smp is None:
+            self.smp = LazySMP(self.workers, self.TT_MB)
+        self.tt = self.smp.tt
+        self.new_game = True
+
+    def _select_move(self):
+        self._start_clock()
+        self._check_endgame()
+        book_move = self._select_book_move()
+        if book_move:
+            return book_move
+        if self.smp is None:
+            self._init_tt()
+        move, best_eval, depth, nodes, _ = self.smp.search(self.board.to_board(), self.MAX_ITER_DEPTH,
+                self.move_time_limit, self.new_game)
+        self.new_game = False
+        if move is None:
+            # no depth was completed in time - the root's tt move if there is one, otherwise the first in move order
+            move = self._tt_move()
+            if move is None or not self.board.is_legal(move):
+                self._new_iteration()
+                move = min(self.board.legal_moves, key = self._move_sortkey)
+            move = decode_move(move)
+        self.nodes += nodes
+        self.depth_record.append(depth)
+        self.move_evals.append((move, best_eval))
+        self.time_record.append(time.time() - self._move_start_time)
+        return move
+
+    def close(self):
+        if self.smp is not None:
+            self.smp.close()
+            self.smp = None
+
+def get_args():
+    parser = argparse.ArgumentParser(description='time to depth of lazy smp on the speedtest positions')
+    parser.add_argument('--depth', type=int, default=5)
+    parser.add_argument('--workers', default='1,2,4,8', help='comma separated worker counts')
+    parser.add_argument('--move_time', default=999, type=int)
+    parser.add_argument('--tt_mb', default=Engine.TT_MB, type=int)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+    print('------')
+    print('lazy smp: depth=%d, %d cpus' % (args.depth, multiprocessing.cpu_count()))
+    print('------')
+    base_time = None
+    for workers in [int(n) for n in args.workers.split(',')]:
+        smp = LazySMP(workers, args.tt_mb)
+        total_time = 0
+        total_nodes = 0
+        reached = 0
+        # the positions are searched as they are, without playing their moves first as speedtest does
+        for fen, _ in POSITIONS:
+            move, value, depth, nodes, depth_time = smp.search(chess.Board(fen), args.depth, args.move_time,
+                                                               new_game = True)
+            if depth == args.depth:
+                reached += 1
+            total_time += depth_time or 0
+            total_nodes += nodes
+        smp.close()
+        if base_time is None:
+            base_time = total_time
+        print('%d workers: %.2fs to depth %d (%d/%d positions), %d nodes [%.1fk nps], speedup %.2f' % (
+                workers, total_time, args.depth, reached, len(POSITIONS), total_nodes,
+                total_nodes / total_time / 1000, base_time / total_time))
@@ -4,6 +4,8 @@ import importlib
 import sys
 import time
 
+import instrument
+
 # Might want to add some more from here: https://www.chessprogramming.org/Test-Positions
 # Also: https://www.chessprogramming.org/Strategic_Test_Suite
 POSITIONS = [
@@ -38,16 +40,10 @@ def get_args():
     parser.add_argument('--timing', action='store_true')
     parser.add_argument('--detail', action='store_true')
     parser.add_argument('--move_time', default=999, type=int)
+    parser.add_argument('--stats', type=str, help='write eval term and hash table stats to this json file')
     args = parser.parse_args()
     return args
 
-args = get_args()
-ENGINE = importlib.import_module(args.module)
-DEPTH = args.depth
-MOVE_TIME_LIMIT = args.move_time
-DETAIL = args.detail
-TIMING = args.timing
-
 TIMES = {}
 def timing(f):
     def wrap(*args, **kwargs):
@@ -62,21 +58,26 @@ def timing(f):
 
 class Speedtest:
 
-    e = ENGINE.Engine()
-    e.LOG = 0
-    e.PRINT = 0
-    e.DISPLAY = 0
-    e.ITERATIVE = 1
-    e.MAX_ITER_DEPTH = DEPTH
-    e.DEPTH = DEPTH
-    e.move_time_limit = MOVE_TIME_LIMIT
-    e.BOOK = 0
+    def __init__(self):
+        self.e = e = ENGINE.Engine()
+        e.LOG = 0
+        e.PRINT = 0
+        e.DISPLAY = 0
+        e.ITERATIVE = 1
+        e.MAX_ITER_DEPTH = DEPTH
+        e.DEPTH = DEPTH
+        e.move_time_limit = MOVE_TIME_LIMIT
+        e.BOOK = 0
 
-    total_nodes = 0
-    total_time = 0
-    total_all_moves = 0
-    total_used_moves = 0
-    total_used_q_moves = 0
+        self.total_nodes = 0
+        self.total_time = 0
+        self.total_all_moves = 0
+        self.total_used_moves = 0
+        self.total_used_q_moves = 0
+
+        # eval instrumentation, with --timing or --stats
+        self.stats = None
+        self.position_stats = []
 
     def run(self):
         print('------')
@@ -84,9 +85,21 @@ class Speedtest:
         print('------')
         if TIMING:
             self.inject_timing()
+        if TIMING or STATS_FILE:
+            self.stats = instrument.EvalStats()
+            self.stats.enable()
         for fen, extra_moves in POSITIONS:
             self.test(fen, extra_moves)
         self.report()
+        if STATS_FILE:
+            instrument.dump(STATS_FILE, {
+                'depth': DEPTH,
+                'nodes': self.total_nodes,
+                'time': self.total_time,
+                'terms': self.stats.term_stats(),
+                'positions': self.position_stats,
+            })
+            print('stats written to %s' % STATS_FILE)
 
     def report(self):
         print('total time: %.2fs' % self.total_time)
@@ -101,18 +114,17 @@ class Speedtest:
         print('-'*6)
         for fname, (t, count) in TIMES.items():
             print('%s: %.2fs [%.1f%%]  %d x %.2fus' % (fname, t, 100*t/self.total_time, count, 1000000*t/count))
+        print('-'*6)
+        print(self.stats.report())
         print()
 
     def inject_timing(self):
         # note: doesn't work well with recursive functions such as quiescence and negamax
-        ENGINE.Board.is_stalemate = timing(ENGINE.Board.is_stalemate)
+        # (the eval terms are timed by the eval instrumentation)
         e = self.e
         e.is_checkmate = timing(e.is_checkmate)
-        e._is_draw = timing(e._is_draw)
         e._make_move = timing(e._make_move)
         e._search_root = timing(e._search_root)
-        e._evaluate_board = timing(e._evaluate_board)
-        e._piece_eval = timing(e._piece_eval)
         e._sorted_moves = timing(e._sorted_moves)
         e._sorted_q_moves = timing(e._sorted_q_moves)
 
@@ -123,9 +135,9 @@ class Speedtest:
             move = self.e._play_move()
             if DETAIL:
                 print('played', move)
-            if self.e.board.is_game_over():
+            if self.e.board.to_board().is_game_over():
                 break
-        if not self.e.board.is_game_over():
+        if not self.e.board.to_board().is_game_over():
             move = self.e._select_move()
             if DETAIL:
                 print('selected %s [%.1fs]' % (self.e.board.san(move), time.time() - t0))
@@ -135,14 +147,27 @@ class Speedtest:
         self.total_all_moves += self.e.all_moves
         self.total_used_moves += self.e.used_moves
         self.total_used_q_moves += self.e.q_used_moves
+        if STATS_FILE:
+            self.position_stats.append(dict(fen = fen, time = t, **self.stats.engine_stats(self.e)))
         knps = self.e.nodes / t / 1000
         if DETAIL:
             print('nodes:', self.e.nodes, '[%.1fk nps]' % knps)
-            print('evals: %s (%.0f%% fetched)' % (self.e.ev, 100*self.e.tt/self.e.ev))
+            for table in self.e.hash_tables():
+                print(table)
+            board = self.e.board
+            print('lazy evals: %d of %d' % (board.lazy_exits, board.lazy_exits + board.full_evals))
             print('moves: %d [%.0f%% cutoff], q moves: %d [%.0f%% cutoff]' %
                     (self.e.used_moves, 100*(self.e.all_moves-self.e.used_moves)/self.e.all_moves,
                         self.e.q_used_moves, 100*(self.e.q_all_moves-self.e.q_used_moves)/self.e.q_all_moves))
             print('top moves:', self.e.top_hits)
 
 if __name__ == '__main__':
+    # (the positions can be imported, e.g. by smp.py)
+    args = get_args()
+    ENGINE = importlib.import_module(args.module)
+    DEPTH = args.depth
+    MOVE_TIME_LIMIT = args.move_time
+    DETAIL = args.detail
+    TIMING = args.timing
+    STATS_FILE = args.stats
     Speedtest().run()
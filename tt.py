@@ -0,0 +1,198 @@
+from array import array
+from multiprocessing import shared_memory
+
+# TRANSPOSITION TABLE
+# a fixed number of buckets, sized in MB, each with two slots: the first is depth-preferred (only replaced by an
+# entry searched at least as deep, or one left from an older search), and the second always replaced - so deep
+# entries survive, while the shallow ones that most of the tree consists of still get stored.
+#
+# each slot is two ints in flat arrays (rather than a tuple object per entry): the upper 32 bits of the key, as a
+# check for the lower bits that select the bucket, and the entry packed into 64 bits:
+#
+#   move (18 bits) | bound + 1 (2) | depth (8) | age (8) | score + SCORE_OFFSET (20)
+#
+# the bound is kept plus one so that an empty slot, which is all zeros, can't be mistaken for an entry. the age
+# is the number of the search (see new_search) that stored the entry.
+#
+# the key check is stored xored with the entry (folded to 32 bits), so that a slot whose check and entry were
+# written by different processes (see shared below) just doesn't match - rather than giving another position's
+# entry, and possibly an illegal move.
+#
+# the best move of a position is kept with its entry, so this is also where search gets the move to try first.
+
+# bounds
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+MOVE_BITS = 18
+MOVE_MASK = (1 << MOVE_BITS) - 1
+BOUND_SHIFT = 18
+DEPTH_SHIFT = 20
+AGE_SHIFT = 28
+SCORE_SHIFT = 36
+SCORE_OFFSET = 1 << 19 # scores are within +-INF, which is well below this
+
+MAX_DEPTH = 255
+MAX_AGE = 255
+
+SLOT_BYTES = 12 # a 4 byte key check and an 8 byte entry
+FOLD_MASK = (1 << 32) - 1
+
+def _buckets(mb):
+    return max(1, int(mb * 2**20) // (2 * SLOT_BYTES))
+
+class TranspositionTable(object):
+
+    __slots__ = ('name', 'buckets', 'keys', 'values', 'age', 'used', 'hits', 'misses', 'evictions', 'shm')
+
+    # for Engine._memory_size, which treats this as one of the hash tables
+    int_values = True
+
+    def __init__(self, mb, name = 'tt', shm = None):
+        # shm: a SharedMemory block (see shared) to keep the table in, rather than in arrays of this process
+        self.name = name
+        self.buckets = _buckets(mb)
+        self.shm = shm
+        if shm is not None:
+            size = self.size
+            self.keys = shm.buf[:4 * size].cast('I')
+            self.values = shm.buf[4 * size:SLOT_BYTES * size].cast('q')
+            self.age = 0
+            self.used = 0
+            self.reset_stats()
+        else:
+            self.clear()
+
+    @classmethod
+    def shared(cls, mb, name = 'tt'):
+        """ a table in a new shared memory block, which other processes can attach to by its name """
+        shm = shared_memory.SharedMemory(create = True, size = 2 * _buckets(mb) * SLOT_BYTES)
+        return cls(mb, name, shm)
+
+    @classmethod
+    def attach(cls, shm_name, mb, name = 'tt'):
+        return cls(mb, name, shared_memory.SharedMemory(name = shm_name))
+
+    def close(self, unlink = False):
+        # only for shared tables - the process that created the block unlinks it
+        if self.shm is not None:
+            self.keys.release()
+            self.values.release()
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+            self.shm = None
+
+    @property
+    def size(self):
+        return 2 * self.buckets
+
+    def clear(self):
+        if self.shm is not None:
+            self.shm.buf[:] = bytes(len(self.shm.buf))
+        else:
+            self.keys = array('I', [0]) * self.size
+            self.values = array('q', [0]) * self.size
+        self.age = 0
+        self.used = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def new_search(self):
+        # entries from earlier searches can then be replaced in the depth-preferred slots
+        self.age = (self.age + 1) & MAX_AGE
+
+    def __len__(self):
+        return self.used
+
+    def probe(self, key):
+        """ (score, bound, depth, move) of the position, or None """
+        i = key % self.buckets << 1
+        check = key >> 32
+        keys = self.keys
+        values = self.values
+        value = values[i]
+        if not value or keys[i] ^ ((value ^ value >> 32) & FOLD_MASK) != check:
+            value = values[i + 1]
+            if not value or keys[i + 1] ^ ((value ^ value >> 32) & FOLD_MASK) != check:
+                self.misses += 1
+                return None
+        self.hits += 1
+        return ((value >> SCORE_SHIFT) - SCORE_OFFSET, (value >> BOUND_SHIFT & 3) - 1, value >> DEPTH_SHIFT & MAX_DEPTH,
+                value & MOVE_MASK)
+
+    def get_move(self, key):
+        """ the best move stored for the position, or None """
+        entry = self.probe(key)
+        if entry is not None and entry[3]:
+            return entry[3]
+        return None
+
+    def store(self, key, move, score, bound, depth):
+        # move may be None or NULL_MOVE if there is no best move, in which case the one already stored for the
+        # position (if any) is kept
+        i = key % self.buckets << 1
+        check = key >> 32
+        keys = self.keys
+        values = self.values
+        value = values[i]
+        same = value and keys[i] ^ ((value ^ value >> 32) & FOLD_MASK) == check
+        if not move:
+            move = 0
+            if same:
+                move = value & MOVE_MASK
+            else:
+                other = values[i + 1]
+                if other and keys[i + 1] ^ ((other ^ other >> 32) & FOLD_MASK) == check:
+                    move = other & MOVE_MASK
+        if value and not same and (value >> DEPTH_SHIFT & MAX_DEPTH) > depth and \
+                (value >> AGE_SHIFT & MAX_AGE) == self.age:
+            # the depth-preferred slot holds a deeper entry of the current search - use the always-replace slot
+            i += 1
+            value = values[i]
+            same = value and keys[i] ^ ((value ^ value >> 32) & FOLD_MASK) == check
+        if not value:
+            self.used += 1
+        elif not same:
+            self.evictions += 1
+        if depth > MAX_DEPTH:
+            depth = MAX_DEPTH
+        value = (move | (bound + 1) << BOUND_SHIFT | depth << DEPTH_SHIFT | self.age << AGE_SHIFT |
+                 (score + SCORE_OFFSET) << SCORE_SHIFT)
+        keys[i] = check ^ ((value ^ value >> 32) & FOLD_MASK)
+        values[i] = value
+
+    def hashfull(self):
+        """ permille of the slots used by the current search, sampled from the first 1000 (as in uci) """
+        n = min(1000, self.size)
+        age = self.age
+        values = self.values
+        used = sum(1 for i in range(n) if values[i] and (values[i] >> AGE_SHIFT & MAX_AGE) == age)
+        return 1000 * used // n
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'used': self.used,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate(),
+            'hashfull': self.hashfull(),
+        }
+
+    def __str__(self):
+        return '%s: %.0f%% hits (%d lookups), %d evictions, %.0f%% full, hashfull %d' % (
+                self.name, 100 * self.hit_rate(), self.hits + self.misses, self.evictions, 100 * self.used / self.size,
+                self.hashfull())
+
+    __repr__ = __str__